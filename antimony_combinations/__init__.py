@@ -1 +1,5 @@
-from antimony_combinations.antimony_combinations import Combinations, HypothesisExtension
+from antimony_combinations.antimony_combinations import Combinations, HypothesisExtension, TopologyView
+from antimony_combinations.archive import TopologyArchive
+from antimony_combinations.cache import ModelCache
+from antimony_combinations.instrumentation import Instrumentation, LoggingSink, CSVSink
+from antimony_combinations.constraints import Requires, Forbid, AtMost, ExactlyOne
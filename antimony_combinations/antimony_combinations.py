@@ -1,30 +1,53 @@
-import site, os, glob
-import pandas, numpy
+import os
+import hashlib
+import numpy
+import numbers
+import operator
+import random
 import re
-import tellurium as te
-import roadrunner as rr
 import typing
-
-# site.addsitedir(r'/home/ncw135/Documents/pycotools3')
-# site.addsitedir(r'D:\pycotools3')
-from pycotools3 import model, tasks, viz
+from math import comb
 from itertools import combinations
 from collections import OrderedDict
-import matplotlib.pyplot as plt
-import seaborn
-import yaml
+from types import MappingProxyType
 import logging
-from copy import deepcopy
-from pycotools3 import tasks, model
-
-mpl_logger = logging.getLogger('matplotlib')
-mpl_logger.setLevel(logging.WARNING)
+import time
+from antimony_combinations import parallel
+from antimony_combinations.archive import EXTENSIONS, TopologyArchive
+from antimony_combinations.cache import ModelCache
+from antimony_combinations.constraints import Requires, Forbid, AtMost, ExactlyOne
+from antimony_combinations.instrumentation import Instrumentation
+
+# tellurium, roadrunner, pycotools3 and pandas are slow to import and are only
+# needed by a few methods, so they are imported where they are used. This keeps
+# importing antimony_combinations, i.e. in worker processes, fast.
+if typing.TYPE_CHECKING:
+    import pandas
+    import roadrunner
+    from pycotools3 import model
 
-logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
 tuple_list = typing.List[typing.Tuple[typing.AnyStr]]
 
+# an antimony identifier. The leading word boundary stops the
+# exponent of numbers like 1e-06 being read as an identifier
+IDENTIFIER = re.compile(r'\b[A-Za-z_]\w*')
+
+# the name declared by a line of the parameter block, after any modifiers
+DECLARATION = re.compile(r'^\s*(?:(?:const|var)\s+)*(\w+)')
+# an antimony line comment
+COMMENT = re.compile(r'(//|#).*')
+# the label in front of a reaction, i.e. `R1:`
+REACTION_LABEL = re.compile(r'^\w+:(?!=)')
+
+
+def _identifiers(antimony: str) -> typing.FrozenSet[str]:
+    """
+    The identifiers used in a piece of antimony, ignoring comments
+    """
+    return frozenset(IDENTIFIER.findall(COMMENT.sub('', antimony)))
+
 class HypothesisExtension:
     """
     Data class for storing information about a hypothesis extension. For usage
@@ -51,6 +74,890 @@ class HypothesisExtension:
         return self.__str__()
 
 
+def _sample_range(rng: random.Random, start: int, stop: int, k: int) -> typing.List[int]:
+    """
+    `k` distinct integers drawn uniformly from `range(start, stop)`.
+    Unlike `random.sample(range(start, stop), k)` this works for ranges
+    longer than sys.maxsize.
+    """
+    size = stop - start
+    if 2 * k > size:
+        return [start + i for i in rng.sample(range(size), k)]
+    chosen = set()
+    while len(chosen) < k:
+        chosen.add(start + rng.randrange(size))
+    return list(chosen)
+
+
+def _popcount(masks: numpy.ndarray) -> numpy.ndarray:
+    """
+    Number of set bits in each element of an unsigned integer array
+    """
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(masks)
+    as_bytes = masks.astype(numpy.uint64).view(numpy.uint8).reshape(masks.shape + (8,))
+    return numpy.unpackbits(as_bytes, axis=-1).sum(axis=-1, dtype=numpy.uint8)
+
+
+def _reverse_bits(masks: numpy.ndarray, n: int) -> numpy.ndarray:
+    """
+    Reverse the lowest n bits of each element of a uint64 array
+    """
+    one = numpy.uint64(1)
+    reversed_masks = numpy.zeros_like(masks)
+    for i in range(n):
+        reversed_masks |= ((masks >> numpy.uint64(i)) & one) << numpy.uint64(n - 1 - i)
+    return reversed_masks
+
+
+class TopologyIndex:
+    """
+    Rank / unrank engine for the space of hypothesis combinations.
+
+    Maps an integer topology ID directly to a subset of hypothesis
+    indices, and back, without materializing the powerset. The ordering
+    is the one produced by :py:func:`itertools.combinations`: subsets
+    are ordered by size and then lexicographically. Subsets that violate
+    a mutual exclusivity constraint are skipped and do not consume an ID.
+
+    Counting is done with the combinatorial number system. Where constraints
+    are involved, the number of valid completions of a partial subset is
+    computed by a memoized recursion whose state only retains the chosen
+    hypotheses that are still relevant to an unchecked constraint, so the
+    cost depends on how entangled the constraints are and not on the
+    size of the space.
+
+    Constraints are compiled into integer bitmasks over the subset,
+    itself encoded as a bitmask:
+
+        * exclusion rules, one mask per pair or forbidden subset of
+          hypotheses that may not all occur together. A subset is valid
+          iff `subset & mask != mask` for every mask.
+        * requirements, a pair of masks `(on, off)`. When hypothesis `on`
+          is in a subset, at least one hypothesis of `off` must be too.
+        * cardinality bounds on a group of hypotheses. The number chosen
+          so far is carried in a small counter packed above the subset
+          bits of the recursion state, so a branch is pruned as soon as
+          it goes over the upper bound.
+
+    Constraints are checked during the recursion, so subsets that break
+    them are never generated. :py:meth:`filter_masks` and :py:meth:`masks`
+    apply the same tests to whole blocks of subsets at once with numpy.
+
+    Examples:
+
+        >>> index = TopologyIndex(5, exclusive=[(3, 4)])
+        >>> len(index)
+        24
+        >>> index.unrank(7)
+        (0, 2)
+        >>> index.rank((1, 2))
+        10
+        >>> index = TopologyIndex(5, exclusive=[(0, 1, 2)])   # at most one of 0, 1 and 2
+        >>> len(index)
+        16
+        >>> index = TopologyIndex(5, requires=[(0, (1,))], cardinality=[((2, 3, 4), 1, 1)])
+        >>> len(index)
+        9
+    """
+
+    def __init__(self, n: int, exclusive: typing.Iterable[typing.Tuple[int, ...]] = (),
+                 forbidden: typing.Iterable[typing.Tuple[int, ...]] = (),
+                 requires: typing.Iterable[typing.Tuple[int, typing.Tuple[int, ...]]] = (),
+                 cardinality: typing.Iterable[typing.Tuple[typing.Tuple[int, ...], int, int]] = (),
+                 min_size: int = 0, max_size: typing.Optional[int] = None) -> None:
+        """
+
+        Args:
+            n:
+                Number of hypotheses
+            exclusive:
+                Groups of hypothesis indices of which at most one may
+                occur in the same subset. Usually these are pairs.
+            forbidden:
+                Groups of hypothesis indices that may not all occur in
+                the same subset, although any fewer of them may.
+            requires:
+                `(i, group)` pairs. Subsets containing hypothesis i must
+                also contain at least one hypothesis of `group`.
+            cardinality:
+                `(group, low, high)` tuples. Subsets must contain between
+                `low` and `high` hypotheses of `group`, inclusive.
+            min_size:
+                Smallest subset in the space
+            max_size:
+                Largest subset in the space. Defaults to n - 1 because
+                the full set of hypotheses has never been part of the
+                enumeration. Use n to include it.
+        """
+        self.n = n
+        if max_size is None:
+            max_size = n - 1
+        elif not 0 <= max_size <= n:
+            raise ValueError('max_size should be between 0 and {}. Got {}'.format(n, max_size))
+        if min_size < 0:
+            raise ValueError('min_size should not be negative. Got {}'.format(min_size))
+        self.min_size = min_size
+        self.max_size = max_size
+
+        forbidden_masks = set()
+        for group in exclusive:
+            for i, j in combinations(sorted(set(self._check(group))), 2):
+                forbidden_masks.add((1 << i) | (1 << j))
+        for group in forbidden:
+            forbidden_masks.add(self._mask(group))
+        #: one bitmask per pair or group of hypotheses that may not all occur together
+        self.exclusion_masks = sorted(forbidden_masks)
+
+        #: (on, off) bitmask pairs. A subset containing `on` must intersect `off`
+        self.requirement_masks = []
+        for i, group in requires:
+            on, off = self._mask((i,)), self._mask(group)
+            if not on & off:
+                self.requirement_masks.append((on, off))
+
+        #: (group mask, low, high) bounds on the number of hypotheses chosen from a group
+        self.cardinality_masks = []
+        full = (1 << n) - 1
+        for group, low, high in cardinality:
+            mask = self._mask(group)
+            if mask == full:
+                # a bound on every hypothesis is a bound on the subset size
+                self.min_size = max(self.min_size, low)
+                self.max_size = min(self.max_size, high)
+            elif low > 0 or high < bin(mask).count('1'):
+                self.cardinality_masks.append((mask, low, high))
+
+        self._constraints = [(mask, 0) for mask in self.exclusion_masks] + self.requirement_masks
+
+        # a constraint is checked once its highest hypothesis has been decided.
+        # _keep[j] holds the decided hypotheses and counters that still matter after deciding j
+        self._closing = [[] for _ in range(n)]
+        self._keep = [0] * n
+        self._last = 0
+        for on, off in self._constraints:
+            mask = on | off
+            top = mask.bit_length() - 1
+            self._closing[top].append((on, off))
+            self._last = max(self._last, top + 1)
+            for j in range(top):
+                self._keep[j] |= mask & ((1 << (j + 1)) - 1)
+
+        # counters live above the n subset bits of the state
+        self._counting = [[] for _ in range(n)]
+        self._closing_counters = [[] for _ in range(n)]
+        offset = n
+        for mask, low, high in self.cardinality_masks:
+            # a counter never holds more than high + 1 before the branch is pruned
+            width = (high + 1).bit_length()
+            field = (1 << width) - 1
+            top = mask.bit_length() - 1
+            for j in range(n):
+                if mask >> j & 1:
+                    self._counting[j].append((offset, field, high))
+            self._closing_counters[top].append((offset, field, low))
+            self._last = max(self._last, top + 1)
+            for j in range(top):
+                self._keep[j] |= field << offset
+            offset += width
+
+        self._memo = {}
+        self._size_counts = [self._count(0, size, 0) for size in range(self.min_size, self.max_size + 1)]
+        self._len = sum(self._size_counts)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for size in range(self.min_size, self.max_size + 1):
+            yield from self._walk(0, size, 0, ())
+
+    def __contains__(self, subset):
+        try:
+            self.rank(subset)
+        except ValueError:
+            return False
+        return True
+
+    def __repr__(self):
+        return '{}(n={}, constraints={})'.format(
+            self.__class__.__name__, self.n, len(self._constraints) + len(self.cardinality_masks))
+
+    def _check(self, group: typing.Iterable[int]) -> typing.Iterable[int]:
+        for i in group:
+            if not 0 <= i < self.n:
+                raise ValueError('hypothesis index "{}" out of range for {} hypotheses'.format(i, self.n))
+        return group
+
+    def _mask(self, group: typing.Iterable[int]) -> int:
+        mask = 0
+        for i in self._check(group):
+            mask |= 1 << i
+        return mask
+
+    def is_valid(self, mask: int) -> bool:
+        """
+        Whether the subset encoded by `mask` satisfies every
+        constraint. The subset size is not checked.
+
+        Args:
+            mask: subset encoded as a bitmask, hypothesis i being bit i
+
+        Returns:
+            bool
+        """
+        for on, off in self._constraints:
+            if mask & on == on and not mask & off:
+                return False
+        for group, low, high in self.cardinality_masks:
+            if not low <= bin(mask & group).count('1') <= high:
+                return False
+        return True
+
+    def filter_masks(self, masks: numpy.ndarray) -> numpy.ndarray:
+        """
+        Vectorized :py:meth:`is_valid` over an array of subset bitmasks
+
+        Args:
+            masks: unsigned integer numpy array of subset bitmasks
+
+        Returns:
+            boolean numpy array, True where the subset is valid
+        """
+        valid = numpy.ones(masks.shape, dtype=bool)
+        for on, off in self._constraints:
+            on, off = masks.dtype.type(on), masks.dtype.type(off)
+            valid &= ((masks & on) != on) | ((masks & off) != 0)
+        for group, low, high in self.cardinality_masks:
+            count = _popcount(masks & masks.dtype.type(group))
+            valid &= (count >= low) & (count <= high)
+        return valid
+
+    def masks(self, block_size: int = 2 ** 20) -> numpy.ndarray:
+        """
+        Bitmasks of every valid subset, in topology ID order, so that
+        `masks()[i]` encodes `unrank(i)`.
+
+        The 2^n candidate subsets are generated and filtered in blocks
+        of `block_size` with numpy. When the space is much smaller than
+        2^n, i.e. because of `max_size` or other constraints, the valid
+        subsets are walked directly instead. Only available for up to 63
+        hypotheses.
+
+        Args:
+            block_size: number of candidate subsets filtered at a time
+
+        Returns:
+            numpy.ndarray of uint64
+        """
+        if self.n > 63:
+            raise ValueError('masks are only available for up to 63 hypotheses, not {}'.format(self.n))
+        # walking costs about as much per subset as filtering a hundred candidates
+        if self._len * 100 < 1 << self.n:
+            return numpy.fromiter((sum(1 << j for j in subset) for subset in self),
+                                  dtype=numpy.uint64, count=self._len)
+        blocks = []
+        for start in range(0, 1 << self.n, block_size):
+            block = numpy.arange(start, min(start + block_size, 1 << self.n), dtype=numpy.uint64)
+            size = _popcount(block)
+            keep = self.filter_masks(block) & (size >= self.min_size) & (size <= self.max_size)
+            block, size = block[keep], size[keep]
+            # ascending key: subset size, then lexicographic order of the
+            # sorted indices, which is descending order of the bit reversed mask
+            full = numpy.uint64((1 << self.n) - 1)
+            blocks.append((size.astype(numpy.uint64) << numpy.uint64(self.n)) | (~_reverse_bits(block, self.n) & full))
+        if not blocks:
+            return numpy.zeros(0, dtype=numpy.uint64)
+        keys = numpy.sort(numpy.concatenate(blocks))
+        full = numpy.uint64((1 << self.n) - 1)
+        return _reverse_bits(~keys & full, self.n)
+
+    def _step(self, j: int, state: int, include: bool) -> typing.Optional[int]:
+        """
+        Decide hypothesis j. Returns the new state or None when
+        a constraint is violated
+        """
+        if include:
+            state |= 1 << j
+            for offset, field, high in self._counting[j]:
+                state += 1 << offset
+                if state >> offset & field > high:
+                    return None
+        for on, off in self._closing[j]:
+            if state & on == on and not state & off:
+                return None
+        for offset, field, low in self._closing_counters[j]:
+            if state >> offset & field < low:
+                return None
+        return state & self._keep[j]
+
+    def _count(self, j: int, r: int, state: int) -> int:
+        """
+        Number of valid ways of choosing r more hypotheses from j..n-1
+        """
+        if r < 0 or r > self.n - j:
+            return 0
+        if j >= self._last:
+            return comb(self.n - j, r)
+        key = (j, r, state)
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        total = 0
+        included = self._step(j, state, True)
+        if included is not None:
+            total += self._count(j + 1, r - 1, included)
+        excluded = self._step(j, state, False)
+        if excluded is not None:
+            total += self._count(j + 1, r, excluded)
+        self._memo[key] = total
+        return total
+
+    def _walk(self, j: int, r: int, state: int, prefix: tuple) -> typing.Iterator[typing.Tuple[int]]:
+        """
+        Yield valid subsets in rank order, never descending
+        into branches without a valid completion
+        """
+        if r == 0:
+            if self._count(j, 0, state):
+                yield prefix
+            return
+        included = self._step(j, state, True)
+        if included is not None and self._count(j + 1, r - 1, included):
+            yield from self._walk(j + 1, r - 1, included, prefix + (j,))
+        excluded = self._step(j, state, False)
+        if excluded is not None and self._count(j + 1, r, excluded):
+            yield from self._walk(j + 1, r, excluded, prefix)
+
+    def unrank(self, topology: int) -> typing.Tuple[int]:
+        """
+        Map a topology ID to its subset of hypothesis indices.
+
+        Args:
+            topology: integer between 0 and len(self) - 1
+
+        Returns:
+            tuple of hypothesis indices in ascending order
+        """
+        if not 0 <= topology < self._len:
+            raise IndexError('topology {} out of range for {} topologies'.format(topology, self._len))
+        size = self.min_size
+        for size_count in self._size_counts:
+            if topology < size_count:
+                break
+            topology -= size_count
+            size += 1
+
+        subset = []
+        state = 0
+        r = size
+        for j in range(self.n):
+            if r == 0:
+                break
+            included = self._step(j, state, True)
+            count = self._count(j + 1, r - 1, included) if included is not None else 0
+            if topology < count:
+                subset.append(j)
+                state = included
+                r -= 1
+            else:
+                topology -= count
+                state = self._step(j, state, False)
+        return tuple(subset)
+
+    def rank(self, subset: typing.Iterable[int]) -> int:
+        """
+        Map a subset of hypothesis indices to its topology ID.
+
+        Args:
+            subset: iterable of hypothesis indices
+
+        Returns:
+            int
+        """
+        subset = sorted(set(subset))
+        size = len(subset)
+        if subset and not (0 <= subset[0] and subset[-1] < self.n):
+            raise ValueError('subset {} contains indices out of range for {} hypotheses'.format(subset, self.n))
+        if not self.min_size <= size <= self.max_size:
+            raise ValueError('subset {} is not part of the topology space'.format(subset))
+        topology = sum(self._size_counts[:size - self.min_size])
+        chosen = set(subset)
+        state = 0
+        r = size
+        for j in range(self.n):
+            if j in chosen:
+                state = self._step(j, state, True)
+                r -= 1
+            else:
+                if r > 0:
+                    included = self._step(j, state, True)
+                    if included is not None:
+                        topology += self._count(j + 1, r - 1, included)
+                state = self._step(j, state, False)
+            if state is None:
+                raise ValueError('subset {} violates a constraint'.format(subset))
+        return topology
+
+
+class CoreTemplate(typing.NamedTuple):
+    """
+    The parsed, immutable core model shared by every topology.
+
+    The `core__` methods of a :py:class:`Combinations` subclass return
+    strings that never change between topologies. They are parsed once
+    into a :py:class:`CoreTemplate` and each topology is then assembled
+    by splicing these precomputed fragments. Use
+    :py:meth:`CoreTemplate.from_combinations` or
+    :py:attr:`Combinations.core_template` to build one.
+    """
+    #: antimony function definitions, or an empty string
+    functions: str
+    #: variable and compartment declarations
+    variables: str
+    #: reaction fragments ('\t' + stripped line + '\n'), one per line of `core__reactions`
+    reaction_lines: typing.Tuple[str, ...]
+    #: the name of the reaction on each line, or None for blank and comment lines
+    reaction_line_names: typing.Tuple[typing.Optional[str], ...]
+    #: read-only mapping of reaction name to its stripped reaction line
+    reactions: typing.Mapping[str, str]
+    #: parameter block lines (with line endings) paired with the name they declare, if any
+    parameters: typing.Tuple[typing.Tuple[typing.Optional[str], str], ...]
+    #: antimony events, or an empty string
+    events: str
+    #: antimony unit definitions, or an empty string
+    units: str
+    #: identifiers used by the events, which are part of every topology
+    event_identifiers: typing.FrozenSet[str]
+    #: read-only mapping of names in the parameter block to the identifiers their value or assignment rule uses
+    dependencies: typing.Mapping[str, typing.FrozenSet[str]]
+
+    @classmethod
+    def from_combinations(cls, combinations: 'Combinations') -> 'CoreTemplate':
+        """
+        Parse the `core__` methods of `combinations`
+
+        Args:
+            combinations: a :py:class:`Combinations` instance
+
+        Returns:
+            :py:class:`CoreTemplate`
+        """
+        reaction_lines = []
+        reaction_line_names = []
+        reactions = OrderedDict()
+        for line in combinations.core__reactions().split('\n'):
+            line = line.strip()
+            ## reaction name is always the first word, without the colon
+            name = DECLARATION.match(line)
+            name = name.group(1) if name is not None else None
+            reaction_lines.append('\t' + line + '\n')
+            reaction_line_names.append(name)
+            if name is not None:
+                reactions.setdefault(name, line)
+
+        parameters = []
+        dependencies = {}
+        for line in combinations.core__parameters().splitlines(keepends=True):
+            name = DECLARATION.match(line)
+            name = name.group(1) if name is not None else None
+            parameters.append((name, line))
+            if name is not None and '=' in line:
+                # `x = k1 * 2` and `x := k1 * S` both depend on the right hand side
+                uses = _identifiers(line.split('=', 1)[1]) - {name}
+                if uses:
+                    dependencies[name] = dependencies.get(name, frozenset()) | uses
+
+        events = combinations.core__events() or ''
+        return cls(
+            functions=combinations.core__functions() or '',
+            variables=combinations.core__variables(),
+            reaction_lines=tuple(reaction_lines),
+            reaction_line_names=tuple(reaction_line_names),
+            reactions=MappingProxyType(reactions),
+            parameters=tuple(parameters),
+            events=events,
+            units=combinations.core__units() or '',
+            event_identifiers=_identifiers(events),
+            dependencies=MappingProxyType(dependencies),
+        )
+
+    def __reduce__(self):
+        # mappingproxy cannot be pickled, so pickle plain dicts and wrap them again on loading
+        fields = self._asdict()
+        fields['reactions'] = dict(self.reactions)
+        fields['dependencies'] = dict(self.dependencies)
+        return _core_template, (fields,)
+
+    @property
+    def parameter_names(self) -> typing.List[str]:
+        """
+        Names declared in the parameter block, in order
+        """
+        return [name for name, line in self.parameters if name is not None]
+
+    def live_symbols(self, identifiers: typing.Iterable[str]) -> typing.Set[str]:
+        """
+        Every symbol a topology needs, given the identifiers used by
+        its reactions.
+
+        Identifiers used by the events are added, then the names that
+        live parameters and assignment rules depend on, until nothing
+        new is found.
+
+        Args:
+            identifiers: identifiers used by the reactions of a topology
+
+        Returns:
+            set
+        """
+        live = set(identifiers)
+        live.update(self.event_identifiers)
+        stack = list(live.intersection(self.dependencies))
+        while stack:
+            for i in self.dependencies.get(stack.pop(), ()):
+                if i not in live:
+                    live.add(i)
+                    stack.append(i)
+        return live
+
+    def parameter_block(self, live: typing.Container[str]) -> str:
+        """
+        The parameter block with declarations of symbols that are not
+        in `live` removed. Lines that do not declare anything, such as
+        comments, are kept.
+
+        Args:
+            live: as returned by :py:meth:`live_symbols`
+
+        Returns:
+            str
+        """
+        return ''.join(line for name, line in self.parameters if name is None or name in live)
+
+
+def _core_template(fields: typing.Dict[str, typing.Any]) -> CoreTemplate:
+    """
+    Unpickle a :py:class:`CoreTemplate`
+    """
+    fields['reactions'] = MappingProxyType(fields['reactions'])
+    fields['dependencies'] = MappingProxyType(fields['dependencies'])
+    return CoreTemplate(**fields)
+
+
+class AntimonyBuilder:
+    """
+    Build antimony for a sequence of topologies by editing the
+    previous model rather than starting from scratch.
+
+    Neighbouring topologies differ by only a few hypotheses. For each
+    new topology the builder swaps the affected reaction lines, keeps a
+    count of how many reaction lines use each identifier and recomputes
+    the live symbols and parameter block only when a declaration goes in
+    or out of use.
+    The output is identical to :py:meth:`Combinations.to_antimony`.
+
+    Topologies can be built in any order, but consecutive IDs are the
+    cheapest since within a subset size they usually differ by a single
+    hypothesis. Used by :py:meth:`Combinations.iter_antimony`,
+    :py:meth:`Combinations.iter_topologies` and
+    :py:meth:`Combinations.export_all`.
+
+    A builder holds mutable state, so use one per thread.
+
+    >>> builder = AntimonyBuilder(c)
+    >>> models = [builder.build(i) for i in range(len(c))]
+    """
+
+    def __init__(self, combinations: 'Combinations') -> None:
+        """
+
+        Args:
+            combinations: a :py:class:`Combinations` instance
+        """
+        self.template = template = combinations.core_template
+        self.index = combinations.topology_index
+        self.name = combinations.__class__.__name__
+        hypotheses = [combinations.model_variant_reactions[i] for i in range(self.index.n)]
+
+        # reaction name -> lines it occupies in the core reactions
+        self._lines_of = {}
+        for j, name in enumerate(template.reaction_line_names):
+            if name is not None:
+                self._lines_of.setdefault(name, []).append(j)
+        # parameter names declared in the parameter block
+        self._declared = set(template.parameter_names)
+
+        self._replaces = [i.to_replace if i.to_replace in self._lines_of else None for i in hypotheses]
+        self._additive = [i.mode == 'additive' for i in hypotheses]
+        self._replace_lines = ['\t' + str(i) + '\n' for i in hypotheses]
+        self._additive_lines = [str(i) + '\n' for i in hypotheses]
+        self._identifiers = [_identifiers(str(i)) for i in hypotheses]
+
+        # state of the last topology built, starting from the core model
+        self._subset = set()
+        self._owners = {}
+        self._lines = list(template.reaction_lines)
+        self._line_identifiers = [_identifiers(i) for i in template.reaction_lines]
+        self._core_identifiers = list(self._line_identifiers)
+        self._used = {}
+        # declared names used by the reactions
+        self._live = set()
+        for ids in self._line_identifiers:
+            self._use(ids)
+        self._use(combinations.keep_parameters)
+        self._reactions = ''.join(self._lines)
+        self._parameters = None
+
+        if combinations.instrumentation is not None:
+            self.build = combinations.instrumentation.wrap('build_antimony', self.build)
+
+    def _use(self, identifiers: typing.Iterable[str]) -> None:
+        for i in identifiers:
+            count = self._used.get(i, 0)
+            if count == 0 and i in self._declared:
+                self._live.add(i)
+                self._parameters = None
+            self._used[i] = count + 1
+
+    def _release(self, identifiers: typing.Iterable[str]) -> None:
+        for i in identifiers:
+            count = self._used[i] - 1
+            if count == 0 and i in self._declared:
+                self._live.discard(i)
+                self._parameters = None
+            self._used[i] = count
+
+    def _replace(self, name: str, owner: typing.Optional[int]) -> None:
+        """
+        Put the reaction line(s) of hypothesis `owner`, or of the core
+        model when `owner` is None, in place of reaction `name`
+        """
+        for j in self._lines_of[name]:
+            self._release(self._line_identifiers[j])
+            if owner is None:
+                self._lines[j] = self.template.reaction_lines[j]
+                self._line_identifiers[j] = self._core_identifiers[j]
+            else:
+                self._lines[j] = self._replace_lines[owner]
+                self._line_identifiers[j] = self._identifiers[owner]
+            self._use(self._line_identifiers[j])
+
+    def _update(self, topology: int) -> None:
+        subset = set(self.index.unrank(topology))
+        changed = subset ^ self._subset
+        self._subset = subset
+
+        names = set()
+        for i in changed:
+            if self._replaces[i] is not None:
+                names.add(self._replaces[i])
+            if self._additive[i]:
+                if i in subset:
+                    self._use(self._identifiers[i])
+                else:
+                    self._release(self._identifiers[i])
+
+        # the first hypothesis that names a reaction replaces it
+        replaced = False
+        for name in names:
+            owner = min((i for i in subset if self._replaces[i] == name), default=None)
+            if owner != self._owners.get(name):
+                self._replace(name, owner)
+                self._owners[name] = owner
+                replaced = True
+        if replaced:
+            self._reactions = ''.join(self._lines)
+
+    def reactions(self, topology: int) -> str:
+        """
+        Build only the reactions of a topology
+
+        Args:
+            topology: topology ID
+
+        Returns:
+            str
+        """
+        self._update(topology)
+        return ''.join([self._reactions] + [self._additive_lines[i] for i in sorted(self._subset)
+                                            if self._additive[i]])
+
+    def build(self, topology: int) -> str:
+        """
+        Build the antimony string of a topology
+
+        Args:
+            topology: topology ID
+
+        Returns:
+            str
+        """
+        self._update(topology)
+        if self._parameters is None:
+            self._parameters = self.template.parameter_block(self.template.live_symbols(self._live))
+
+        template = self.template
+        s = [
+            template.functions,
+            'model {}Topology{}'.format(self.name, topology),
+            template.variables,
+            self._reactions,
+        ]
+        s += [self._additive_lines[i] for i in sorted(self._subset) if self._additive[i]]
+        s += [self._parameters, template.events, template.units, "\nend"]
+        return ''.join(s)
+
+
+def _canonical_reactions(reactions: str) -> str:
+    """
+    A canonical form of a block of reactions that is the same for
+    any two blocks describing the same network. Comments, reaction
+    labels, whitespace and the order of the reactions are discarded.
+    """
+    lines = []
+    for line in reactions.split('\n'):
+        line = ''.join(COMMENT.sub('', line).split())
+        line = REACTION_LABEL.sub('', line).rstrip(';')
+        if line:
+            lines.append(line)
+    return '\n'.join(sorted(lines))
+
+
+class TopologyRecord(typing.NamedTuple):
+    """
+    Yielded by :py:meth:`Combinations.iter_topologies`
+    """
+    #: the topology ID
+    topology: int
+    #: names of the hypothesis extensions in the topology. Empty for the core model
+    hypotheses: typing.Tuple[str, ...]
+    #: the antimony string of the topology
+    antimony: str
+
+
+class ExportSummary(typing.NamedTuple):
+    """
+    Returned by :py:meth:`Combinations.export_all`
+    """
+    #: paths of the files that were written, or the archive members for :py:meth:`Combinations.export_archive`
+    files: typing.List[str]
+    #: wall clock time taken in seconds
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """
+        Models written per second
+        """
+        return len(self.files) / self.seconds if self.seconds else float('inf')
+
+
+def _render_topologies(combinations: 'Combinations', topologies: typing.List[int],
+                       format: str) -> typing.Iterator[typing.Tuple[int, str]]:
+    for topology, antimony in combinations.iter_antimony(topologies):
+        yield topology, antimony if format == 'antimony' else combinations._to_sbml(antimony)
+
+
+def _export_topologies(combinations: 'Combinations', topologies: typing.List[int], format: str) -> typing.List[str]:
+    """
+    Write a chunk of topologies to their topology directories. Used by
+    :py:meth:`Combinations.export_all` in worker processes
+    """
+    combinations._make_topology_dirs(topologies)
+    files = []
+    for topology, content in _render_topologies(combinations, topologies, format):
+        fname = combinations._topology_file(topology, EXTENSIONS[format])
+        with open(fname, 'w') as f:
+            f.write(content)
+        files.append(fname)
+    return files
+
+
+def _build_topologies(combinations: 'Combinations', topologies: typing.List[int],
+                      format: str) -> typing.List[typing.Tuple[int, str]]:
+    """
+    Build a chunk of topologies and return their contents. Used by
+    :py:meth:`Combinations.export_archive` in worker processes
+    """
+    return list(_render_topologies(combinations, topologies, format))
+
+
+class SimulationResults(typing.NamedTuple):
+    """
+    Stacked time courses returned by :py:meth:`Combinations.simulate_all`
+    """
+    #: topology IDs, in ascending order, one per entry in the first axis of `data`
+    topologies: numpy.ndarray
+    #: names of the columns in the last axis of `data`
+    selections: typing.List[str]
+    #: array of shape (topologies, points, selections). Topologies that failed to simulate are NaN
+    data: numpy.ndarray
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.data[:, :, self.selections.index(item)]
+        return tuple.__getitem__(self, item)
+
+
+class CopasiResult(typing.NamedTuple):
+    """
+    One entry of the list returned by :py:meth:`Combinations.to_copasi_all`
+    """
+    #: the topology ID
+    topology: int
+    #: path of the copasi file, or None if the conversion failed
+    copasi_file: typing.Optional[str]
+    #: wall clock time taken to build and convert the topology, in seconds
+    seconds: float
+    #: the error message if the conversion failed, otherwise None
+    error: typing.Optional[str]
+
+
+def _copasi_topologies(combinations: 'Combinations', topologies: typing.List[int]) -> typing.List[CopasiResult]:
+    """
+    Convert a chunk of topologies to copasi files. Used by
+    :py:meth:`Combinations.to_copasi_all` in worker processes
+    """
+    combinations._make_topology_dirs(topologies)
+    results = []
+    builder = AntimonyBuilder(combinations)
+    for topology in topologies:
+        start = time.perf_counter()
+        copasi_file = combinations._topology_file(topology, 'cps')
+        try:
+            combinations._to_copasi(builder.build(topology), copasi_file)
+        except ImportError:
+            raise
+        except Exception as e:
+            LOG.warning('conversion of topology {} to copasi failed: {}'.format(topology, e))
+            results.append(CopasiResult(topology, None, time.perf_counter() - start, '{}: {}'.format(
+                e.__class__.__name__, e)))
+            continue
+        results.append(CopasiResult(topology, copasi_file, time.perf_counter() - start, None))
+    return results
+
+
+def _simulate_topology(combinations: 'Combinations', topology: int, start: float, end: float,
+                       points: int, selections: typing.Optional[typing.List[str]]
+                       ) -> typing.Tuple[int, typing.Optional[numpy.ndarray]]:
+    """
+    Compile and simulate a single topology. Used by
+    :py:meth:`Combinations.simulate_all` in worker processes
+    """
+    try:
+        r = combinations.view(topology).to_roadrunner()
+        data = combinations._simulate(r, start, end, points, selections)
+    except ImportError:
+        raise
+    except Exception as e:
+        # tellurium raises a plain Exception for antimony it cannot load
+        LOG.warning('simulation of topology {} failed: {}'.format(topology, e))
+        return topology, None
+    return topology, data
+
+
 class Combinations:
     """
     Builds combinations of SBML model using antimony
@@ -397,29 +1304,74 @@ class Combinations:
     but this is planned for the near future.
     """
 
+    #: parameters that are never pruned from a model, even when no reaction uses them
+    keep_parameters = ('Cell',)
+
+    #: stage name -> method timed when `instrumentation` is set
+    instrumented_stages = {
+        'index': '_build_topology_index',
+        'enumerate': '_enumerate_masks',
+        'build_reactions': '_build_reactions',
+        'build_antimony': '_build_antimony',
+        'to_sbml': '_to_sbml',
+        'to_roadrunner': '_to_roadrunner',
+        'to_copasi': '_to_copasi',
+        'simulate': '_simulate',
+    }
+
     def __init__(self,
                  mutually_exclusive_reactions: tuple_list = [],
-                 directory: typing.Optional[str] = None) -> None:
+                 directory: typing.Optional[str] = None,
+                 model_cache: typing.Optional[ModelCache] = None,
+                 instrumentation: typing.Optional[Instrumentation] = None,
+                 constraints: typing.Optional[typing.List[typing.Union[Requires, Forbid, AtMost, ExactlyOne]]] = None,
+                 min_hypotheses: int = 0, max_hypotheses: typing.Optional[int] = None) -> None:
         """
 
         Args:
             mutually_exclusive_reactions:
                 An arbitrary length list of tuples of pairs that are names
                 of reactions that should never occur together in the same model.
-                Defaults to an empty list.
+                Tuples of more than two names are groups of which at most one
+                may occur in a model. Defaults to an empty list.
             directory:
                 Root directory for analysis. The default is the directory
                 containing the script being run or the current working directory
                 of the interpreter.
+            model_cache:
+                An optional :py:class:`ModelCache` used by :py:meth:`to_sbml`
+                and :py:meth:`to_roadrunner` to avoid converting and compiling
+                the same model twice. Defaults to None (no caching).
+            instrumentation:
+                An optional :py:class:`Instrumentation` that times each
+                stage of the build pipeline. Defaults to None (no timing).
+            constraints:
+                An optional list of :py:class:`Requires`, :py:class:`Forbid`,
+                :py:class:`AtMost` and :py:class:`ExactlyOne` constraints.
+                Topologies that break them are left out of the topology space.
+            min_hypotheses:
+                Smallest number of hypothesis extensions in a topology.
+                Defaults to 0, i.e. the core model is topology 0.
+            max_hypotheses:
+                Largest number of hypothesis extensions in a topology.
+                Defaults to one less than the number of hypotheses, so the
+                model with every extension is left out unless asked for.
         """
-
+        self.model_cache = model_cache
+        self._instrumentation = None
+        self.instrumentation = instrumentation
+
+        # caches for the combination space. Reset whenever
+        # something they depend on is reassigned
+        self._index = None
+        self._combinations = None
+        self._masks = None
+        self._template = None
+        self._variant_reactions = None
         self.mutually_exclusive_reactions = mutually_exclusive_reactions
-        if self.mutually_exclusive_reactions is not None:
-            if not isinstance(self.mutually_exclusive_reactions, list):
-                raise TypeError('expecting list but got {}'.format(type(self.mutually_exclusive_reactions)))
-            for i in self.mutually_exclusive_reactions:
-                if not isinstance(i, tuple):
-                    raise TypeError('expecting tuple but got {}'.format(type(self.mutually_exclusive_reactions)))
+        self.constraints = constraints
+        self.min_hypotheses = min_hypotheses
+        self.max_hypotheses = max_hypotheses
 
         self._topology = 0
         self.directory = directory
@@ -439,9 +1391,51 @@ class Combinations:
 
         # dict of reactions that vary with topologies and another dict with corresponding hypothesis names
         self.model_variant_reactions, self.topology_names = self._model_variant_reactions()
+        self._check_hypotheses_bounds(self.min_hypotheses, self.max_hypotheses)
 
         # self.model_specific_reactions = self._assembel_model_reactions()[self.topology]
 
+    def __getstate__(self):
+        # the materialized combination list, topology masks and parsed core
+        # model can be large and are cheap to rebuild
+        state = self.__dict__.copy()
+        state['_combinations'] = None
+        state['_masks'] = None
+        state['_template'] = None
+        # timed wrappers are closures, so they are recreated on unpickling
+        for method in self.instrumented_stages.values():
+            state.pop(method, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.instrumentation = self._instrumentation
+
+    @property
+    def instrumentation(self) -> typing.Optional[Instrumentation]:
+        """
+        The :py:class:`Instrumentation` timing the stages in
+        `instrumented_stages`, or None. Assign None to stop timing, which
+        removes the timed wrappers altogether.
+
+        Returns:
+            :py:class:`Instrumentation` or None
+        """
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, new: typing.Optional[Instrumentation]) -> None:
+        for method in self.instrumented_stages.values():
+            self.__dict__.pop(method, None)
+        self._instrumentation = new
+        if new is not None:
+            for stage, method in self.instrumented_stages.items():
+                setattr(self, method, new.wrap(stage, getattr(self, method)))
+
+    def _log_instrumentation(self) -> None:
+        if self._instrumentation is not None:
+            LOG.info('time per stage:\n{}'.format(self._instrumentation.report()))
+
     def __str__(self):
         return "{}(topology={})".format(self.__class__.__name__, self.topology)
 
@@ -450,15 +1444,28 @@ class Combinations:
 
     def __len__(self):
         """
-        Subtract 1 for 0 indexed python
+        Number of topologies. Counted once by the
+        :py:attr:`topology_index` so this is O(1).
         :return:
         """
-        return len(list(self._get_combinations()))
+        return len(self.topology_index)
 
     def __iter__(self):
-        return self
+        """
+        Iterate over a :py:class:`TopologyView` of every topology.
+
+        Each call returns a new, independent iterator, so nested loops
+        over the same instance, or loops in different threads, do not
+        interfere with each other.
+        """
+        return (TopologyView(self, i) for i in range(len(self)))
 
     def __next__(self):
+        """
+        Legacy cursor based iteration that moves the `topology`
+        attribute of the instance. Not used by `for` loops, which go
+        through :py:meth:`__iter__`.
+        """
 
         if self.topology < len(self):
             top = self[self.topology]
@@ -469,40 +1476,270 @@ class Combinations:
             raise StopIteration
 
     def __getitem__(self, item):
-        if not isinstance(item, (int, slice,
+        # numbers.Integral includes the numpy integers returned by query()
+        if not isinstance(item, (numbers.Integral, slice,
                                  tuple, list)):
             raise TypeError('"item" should be of type int or slice. Got "{}" instead'.format(type(item)))
-        if isinstance(item, int):
-            self.topology = item
+        if isinstance(item, numbers.Integral):
+            self.topology = self.view(item).topology
             return self
         elif isinstance(item, slice):
             required = range(item.start if item.start is not None else 0,
                              item.stop if item.stop is not None else len(self),
                              item.step if item.step is not None else 1)
-            return [deepcopy(self[i]) for i in required]
+            return [TopologyView(self, i) for i in required]
         elif isinstance(item, (tuple, list)):
             for i in item:
-                if not isinstance(i, int):
+                if not isinstance(i, numbers.Integral):
                     raise ValueError('expected an integer for index. Got "{}"'.format(type(i)))
-            return [deepcopy(self[i]) for i in item]
+            return [TopologyView(self, int(i)) for i in item]
+
+    def view(self, topology: int) -> 'TopologyView':
+        """
+        Get a :py:class:`TopologyView` of a topology.
+
+        Unlike `c[topology]`, this does not change the `topology`
+        attribute of the instance, so it is safe to use from several
+        threads at once.
+
+        Args:
+            topology: topology ID. Negative IDs count from the end.
+
+        Returns:
+            :py:class:`TopologyView`
+        """
+        n = len(self)
+        topology = operator.index(topology)
+        if topology < 0:
+            topology += n
+        if not 0 <= topology < n:
+            raise IndexError('topology {} out of range for {} topologies'.format(topology, n))
+        return TopologyView(self, topology)
+
+    def sample(self, n: int, seed: typing.Optional[int] = None,
+               stratify_by_size: bool = True) -> typing.List['TopologyView']:
+        """
+        A random sample of `n` distinct topologies, drawn without
+        enumerating the topology space.
+
+        Topology IDs are drawn directly from `range(len(self))` and only
+        unranked, by :py:meth:`TopologyIndex.unrank`, when a view is used.
+        Every ID is a valid topology, since `mutually_exclusive_reactions`
+        and `constraints` are compiled into the :py:attr:`topology_index`,
+        so no draws are rejected and sampling 1000 topologies from a space
+        of 2^40 is instant.
+
+        >>> sample = c.sample(3, seed=1)
+        >>> sample
+        [MyCombModel(topology=0), MyCombModel(topology=4), MyCombModel(topology=23)]
+        >>> [i.get_hypotheses() for i in sample]
+        [['Null'], ['feedback2'], ['additive1', 'additive2', 'feedback2', 'replace_reaction']]
+
+        Args:
+            n: number of topologies, at most len(self)
+            seed: seed for the random number generator
+            stratify_by_size:
+                When True, the sample is spread as evenly as possible over
+                the number of hypotheses in a topology, so that small and
+                large topologies are not swamped by the far more numerous
+                mid sized ones. When False, every topology is equally likely.
+
+        Returns:
+            list of :py:class:`TopologyView`, sorted by topology ID
+        """
+        total = len(self)
+        if not 0 <= n <= total:
+            raise ValueError('cannot sample {} topologies out of {}'.format(n, total))
+        rng = random.Random(seed)
+        if not stratify_by_size:
+            return [TopologyView(self, i) for i in sorted(_sample_range(rng, 0, total, n))]
+
+        counts = self.topology_index._size_counts
+        # water fill: split what is left evenly over the sizes that still have
+        # topologies to spare, until all n are allocated
+        allocated = [0] * len(counts)
+        remaining = n
+        open_sizes = [i for i, count in enumerate(counts) if count]
+        while remaining:
+            share, extra = divmod(remaining, len(open_sizes))
+            lucky = set(rng.sample(open_sizes, extra))
+            for i in open_sizes:
+                take = min(counts[i] - allocated[i], share + (i in lucky))
+                allocated[i] += take
+                remaining -= take
+            open_sizes = [i for i in open_sizes if allocated[i] < counts[i]]
+
+        topologies = []
+        start = 0
+        for count, k in zip(counts, allocated):
+            topologies += sorted(_sample_range(rng, start, start + count, k))
+            start += count
+        return [TopologyView(self, i) for i in topologies]
+
+    def build(self, topology: int) -> str:
+        """
+        Build the antimony string of a topology without touching
+        any state on the instance.
+
+        Safe to call from several threads at once, i.e.
+
+        >>> with ThreadPoolExecutor(8) as pool:
+        >>>     models = list(pool.map(c.build, range(len(c))))
+
+        Args:
+            topology: topology ID
+
+        Returns:
+            str
+        """
+        return self.view(topology).to_antimony()
+
+    def iter_topologies(self, start: int = 0, stop: typing.Optional[int] = None,
+                        filter: typing.Optional[typing.Callable[[int, typing.Tuple[str, ...]], bool]] = None,
+                        shard: int = 0, num_shards: int = 1) -> typing.Iterator[TopologyRecord]:
+        """
+        Lazily yield a :py:class:`TopologyRecord` for each topology.
+
+        Models are built one at a time as the generator is consumed, so
+        memory use does not grow with the number of topologies. Neither
+        the instance nor its `topology` attribute is modified.
+
+        `shard` and `num_shards` split the space deterministically between
+        independent processes or cluster jobs: shard k of n gets every
+        topology whose ID modulo n is k, which keeps the mix of small and
+        large models even across shards.
+
+        >>> for record in c.iter_topologies(start=1000, shard=2, num_shards=16):
+        >>>     simulate(record.antimony)
+
+        Args:
+            start:
+                First topology ID to consider, i.e. to resume a previous run
+            stop:
+                Topology ID to stop before. Defaults to `len(self)`
+            filter:
+                Optional callable taking the topology ID and the tuple of
+                hypothesis names. Topologies for which it returns False are
+                skipped before their model is built.
+            shard:
+                Which shard to yield, between 0 and `num_shards` - 1
+            num_shards:
+                Number of shards the space is split into
+
+        Returns:
+            Iterator of :py:class:`TopologyRecord`
+        """
+        # checked here rather than in the generator so that bad arguments
+        # fail at the call, not on the first iteration
+        if start < 0:
+            raise ValueError('start should not be negative. Got {}'.format(start))
+        if num_shards < 1:
+            raise ValueError('num_shards should be at least 1. Got {}'.format(num_shards))
+        if not 0 <= shard < num_shards:
+            raise ValueError('shard should be between 0 and {}. Got {}'.format(num_shards - 1, shard))
+        return self._iter_topologies(start, stop, filter, shard, num_shards)
+
+    def _iter_topologies(self, start: int, stop: typing.Optional[int],
+                         filter: typing.Optional[typing.Callable[[int, typing.Tuple[str, ...]], bool]],
+                         shard: int, num_shards: int) -> typing.Iterator[TopologyRecord]:
+        n = len(self)
+        stop = n if stop is None else min(stop, n)
+        # first ID >= start that belongs to this shard
+        first = start + (shard - start) % num_shards
+        builder = AntimonyBuilder(self)
+        for topology in range(first, stop, num_shards):
+            hypotheses = tuple(self.topology_names[i] for i in self.topology_index.unrank(topology))
+            if filter is not None and not filter(topology, hypotheses):
+                continue
+            yield TopologyRecord(topology, hypotheses, builder.build(topology))
+
+    def iter_antimony(self, topologies: typing.Optional[typing.Iterable[int]] = None
+                      ) -> typing.Iterator[typing.Tuple[int, str]]:
+        """
+        Lazily yield `(topology, antimony)` for each topology.
+
+        Each model is produced from the previous one with an
+        :py:class:`AntimonyBuilder`, so walking the whole space is much
+        faster than calling :py:meth:`build` for every topology.
+
+        Args:
+            topologies:
+                IDs of the topologies to build. Defaults to all of them,
+                in order.
+
+        Returns:
+            Iterator of (int, str) tuples
+        """
+        if topologies is None:
+            topologies = range(len(self))
+        builder = AntimonyBuilder(self)
+        for topology in topologies:
+            yield topology, builder.build(topology)
+
+    def network_key(self, topology: int) -> str:
+        """
+        A hash of the reaction network of a topology.
+
+        Reactions are put in a canonical form first: comments, reaction
+        labels and whitespace are dropped and the reactions are sorted.
+        Topologies with the same key describe the same network, for
+        instance when a 'replace' hypothesis restates the core reaction
+        or an additive hypothesis duplicates one. Parameters are pruned
+        based on the reactions, so such topologies are the same model.
+
+        Args:
+            topology: topology ID
+
+        Returns:
+            str
+        """
+        return self._network_key(self._build_reactions(self.view(topology).topology))
+
+    @staticmethod
+    def _network_key(reactions: str) -> str:
+        return hashlib.sha256(_canonical_reactions(reactions).encode('utf-8')).hexdigest()
+
+    def equivalence_classes(self, topologies: typing.Optional[typing.Iterable[int]] = None
+                            ) -> typing.Dict[str, typing.List[int]]:
+        """
+        Group topologies that describe the same reaction network.
+
+        >>> classes = c.equivalence_classes()
+        >>> unique = [ids[0] for ids in classes.values()]
+
+        Args:
+            topologies:
+                IDs of the topologies to group. Defaults to all of them.
+
+        Returns:
+            dict mapping each :py:meth:`network_key` to the list of topology
+            IDs with that network, in order of first appearance
+        """
+        if topologies is None:
+            topologies = range(len(self))
+        builder = AntimonyBuilder(self)
+        classes = {}
+        for topology in topologies:
+            classes.setdefault(self._network_key(builder.reactions(topology)), []).append(topology)
+        return classes
 
     def to_list(self) -> list:
         """
         Returns:
-            a list of :py:class:`Combination` objects
+            a list of :py:class:`TopologyView` objects
             each of which is preset for access to
             a particular model topology
         """
-        return [deepcopy(self[i]) for i in range(len(self))]
+        return [TopologyView(self, i) for i in range(len(self))]
 
     def items(self) -> typing.List:
         """
         Similar to a `dict.items()`. 
         
-        Returns: a list of tuples of the form [(i, Combinations(topology=i), ...]
+        Returns: a list of tuples of the form [(i, TopologyView(topology=i), ...]
 
         """
-        return [(i, deepcopy(self[i])) for i in range(len(self))]
+        return [(i, TopologyView(self, i)) for i in range(len(self))]
 
     def _model_variant_reactions(self) -> typing.Tuple[typing.Dict[int, str], str]:
         """
@@ -528,6 +1765,129 @@ class Combinations:
             names[i] = hypothesis_reaction_names[i]
         return dct, names
 
+    @property
+    def mutually_exclusive_reactions(self) -> tuple_list:
+        """
+        List of tuples of hypothesis names that should never
+        occur together in the same model. Assigning a new value
+        invalidates the cached combination space.
+
+        Returns:
+            list of tuples
+        """
+        return self._mutually_exclusive_reactions
+
+    @mutually_exclusive_reactions.setter
+    def mutually_exclusive_reactions(self, new) -> None:
+        if new is not None:
+            if not isinstance(new, list):
+                raise TypeError('expecting list but got {}'.format(type(new)))
+            for i in new:
+                if not isinstance(i, tuple):
+                    raise TypeError('expecting tuple but got {}'.format(type(new)))
+                if len(i) < 2:
+                    raise ValueError('mutually exclusive groups need at least two names. Got {}'.format(i))
+        self._mutually_exclusive_reactions = new
+        self._reset_topology_space()
+
+    @property
+    def constraints(self) -> typing.List[typing.Union[Requires, Forbid, AtMost, ExactlyOne]]:
+        """
+        List of constraints on which hypotheses may occur together.
+        Assigning a new value invalidates the cached combination space.
+
+        Returns:
+            list
+        """
+        return self._constraints
+
+    @constraints.setter
+    def constraints(self, new) -> None:
+        new = list(new or [])
+        for i in new:
+            if not isinstance(i, (Requires, Forbid, AtMost, ExactlyOne)):
+                raise TypeError('expecting one of Requires, Forbid, AtMost or ExactlyOne but got {}'.format(type(i)))
+        self._constraints = new
+        self._reset_topology_space()
+
+    @property
+    def min_hypotheses(self) -> int:
+        """
+        Smallest number of hypothesis extensions in a topology.
+        Assigning a new value invalidates the cached combination space.
+
+        Returns:
+            int
+        """
+        return self._min_hypotheses
+
+    @min_hypotheses.setter
+    def min_hypotheses(self, new: int) -> None:
+        self._check_hypotheses_bounds(new, getattr(self, '_max_hypotheses', None))
+        self._min_hypotheses = new
+        self._reset_topology_space()
+
+    @property
+    def max_hypotheses(self) -> typing.Optional[int]:
+        """
+        Largest number of hypothesis extensions in a topology, or None
+        for one less than the number of hypotheses. Assigning a new value
+        invalidates the cached combination space.
+
+        Returns:
+            int or None
+        """
+        return self._max_hypotheses
+
+    @max_hypotheses.setter
+    def max_hypotheses(self, new: typing.Optional[int]) -> None:
+        self._check_hypotheses_bounds(self._min_hypotheses, new)
+        self._max_hypotheses = new
+        self._reset_topology_space()
+
+    def _check_hypotheses_bounds(self, low: int, high: typing.Optional[int]) -> None:
+        """
+        Raise a ValueError for `min_hypotheses` and `max_hypotheses` that
+        cannot describe a topology space. Checked against the number of
+        hypotheses once it is known, i.e. again at the end of `__init__`.
+        """
+        n = len(self._variant_reactions) if self._variant_reactions is not None else None
+        if low < 0 or (n is not None and low > n):
+            raise ValueError('min_hypotheses should be between 0 and {}. Got {}'.format(
+                'the number of hypotheses' if n is None else n, low))
+        if high is None:
+            # the default maximum is n - 1, which leaves out the model with every hypothesis
+            if n is not None and low and low >= n:
+                raise ValueError('min_hypotheses ({}) should be less than the number of hypotheses ({}) '
+                                 'unless max_hypotheses is set'.format(low, n))
+            return
+        if high < 0 or (n is not None and high > n):
+            raise ValueError('max_hypotheses should be between 0 and {}. Got {}'.format(
+                'the number of hypotheses' if n is None else n, high))
+        if low > high:
+            raise ValueError('min_hypotheses ({}) should not be more than max_hypotheses ({})'.format(low, high))
+
+    def _reset_topology_space(self) -> None:
+        self._index = None
+        self._combinations = None
+        self._masks = None
+
+    @property
+    def model_variant_reactions(self) -> typing.Dict[int, HypothesisExtension]:
+        """
+        Dict mapping hypothesis index to its :py:class:`HypothesisExtension`.
+        Assigning a new value invalidates the cached combination space.
+
+        Returns:
+            OrderedDict
+        """
+        return self._variant_reactions
+
+    @model_variant_reactions.setter
+    def model_variant_reactions(self, new) -> None:
+        self._variant_reactions = new
+        self._reset_topology_space()
+
     @property
     def topology(self) -> int:
         """
@@ -559,21 +1919,47 @@ class Combinations:
         A full path to a directory for files pertaining 
         to the current topology. Currently only used for 
         generating copasi files. 
+
+        The directory is only created when a file is written
+        to it, i.e. by :py:meth:`to_copasi` or :py:meth:`export_all`.
         
         Returns:
 
         """
-        d = os.path.join(self.directory, 'Topology{}'.format(self.topology))
-        if not os.path.isdir(d):
-            os.makedirs(d)
-        return d
+        return self._topology_dir(self.topology)
+
+    def _topology_dir(self, topology: int) -> str:
+        return os.path.join(self.directory, 'Topology{}'.format(topology))
+
+    def _make_topology_dirs(self, topologies: typing.Iterable[int]) -> None:
+        """
+        Create the topology directories of `topologies`, one mkdir
+        call each, before writing files to them
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for topology in topologies:
+            try:
+                os.mkdir(self._topology_dir(topology))
+            except FileExistsError:
+                pass
+
+    def _topology_file(self, topology: int, extension: str) -> str:
+        return os.path.join(self._topology_dir(topology), 'topology{}.{}'.format(topology, extension))
 
     @property
     def time_course_graphs(self) -> str:
-        d = os.path.join(self.topology_dir, 'TimeCourseSimulations')
-        if not os.path.isdir(d):
-            os.makedirs(d)
-        return d
+        """
+        A full path to a directory for time course graphs of the current
+        topology. The directory is not created, so use
+        `os.makedirs(c.time_course_graphs, exist_ok=True)` before saving to it.
+
+        Returns:
+
+        """
+        return self._time_course_graphs(self.topology)
+
+    def _time_course_graphs(self, topology: int) -> str:
+        return os.path.join(self._topology_dir(topology), 'TimeCourseSimulations')
 
     @property
     def copasi_file(self) -> str:
@@ -582,18 +1968,252 @@ class Combinations:
         Returns:
 
         """
-        return os.path.join(self.topology_dir, 'topology{}.cps'.format(self.topology))
+        return self._topology_file(self.topology, 'cps')
+
+    @property
+    def antimony_file(self) -> str:
+        """
+        A full path to the antimony file for current topology
+        Returns:
+
+        """
+        return self._topology_file(self.topology, 'ant')
+
+    @property
+    def sbml_file(self) -> str:
+        """
+        A full path to the sbml file for current topology
+        Returns:
+
+        """
+        return self._topology_file(self.topology, 'xml')
 
-    def to_copasi(self) -> model.Model:
+    def export_all(self, format: str = 'antimony', workers: typing.Optional[int] = None,
+                   chunksize: typing.Optional[int] = None,
+                   topologies: typing.Optional[typing.Iterable[int]] = None) -> ExportSummary:
+        """
+        Write every topology to its topology directory using a pool of
+        worker processes.
+
+        The instance is sent to each worker once and topologies are
+        handed out in chunks of IDs, so each worker builds its models
+        itself rather than receiving copies. Within a chunk, each model is
+        built from the previous one with an :py:class:`AntimonyBuilder`.
+        Files are written to :py:attr:`antimony_file` or :py:attr:`sbml_file`.
+
+        Args:
+            format:
+                Either 'antimony' or 'sbml'
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 1 to export in the current process.
+            chunksize:
+                Number of topologies handed to a worker at a time
+            topologies:
+                IDs of the topologies to export. Defaults to all of them.
+
+        Returns:
+            :py:class:`ExportSummary`
+        """
+        if format not in ('antimony', 'sbml'):
+            raise ValueError('format should be "antimony" or "sbml". Got "{}" instead'.format(format))
+        if topologies is None:
+            topologies = range(len(self))
+
+        start = time.perf_counter()
+        files = list(parallel.map_chunks(self, _export_topologies, topologies, args=(format,),
+                                         workers=workers, chunksize=chunksize))
+        summary = ExportSummary(files=files, seconds=time.perf_counter() - start)
+        LOG.info('exported {} topologies as {} in {:.2f}s ({:.1f} models/s)'.format(
+            len(files), format, summary.seconds, summary.throughput))
+        self._log_instrumentation()
+        return summary
+
+    def export_archive(self, path: str, format: str = 'antimony', workers: typing.Optional[int] = None,
+                       chunksize: typing.Optional[int] = None,
+                       topologies: typing.Optional[typing.Iterable[int]] = None) -> ExportSummary:
+        """
+        Write every topology into a single zip archive rather than one
+        directory per topology.
+
+        Models are built by a pool of worker processes, as in
+        :py:meth:`export_all`, and written to the archive by the current
+        process along with a manifest of topology IDs and hypotheses.
+        No topology directories are created. Read the archive with
+        :py:class:`TopologyArchive`, which gives random access by
+        topology ID and can extract single models to a topology
+        directory on demand.
+
+        Args:
+            path:
+                Path of the zip archive. An existing file is replaced.
+            format:
+                Either 'antimony' or 'sbml'
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 1 to build the models in the current process.
+            chunksize:
+                Number of topologies handed to a worker at a time
+            topologies:
+                IDs of the topologies to export. Defaults to all of them.
+
+        Returns:
+            :py:class:`ExportSummary`
+        """
+        if format not in ('antimony', 'sbml'):
+            raise ValueError('format should be "antimony" or "sbml". Got "{}" instead'.format(format))
+        if topologies is None:
+            topologies = range(len(self))
+
+        start = time.perf_counter()
+        results = parallel.map_chunks(self, _build_topologies, topologies, args=(format,),
+                                      workers=workers, chunksize=chunksize)
+        models = ((topology, tuple(self.topology_names[i] for i in self.topology_index.unrank(topology)), content)
+                  for topology, content in results)
+        files = TopologyArchive.write(path, models, format=format, model=self.__class__.__name__)
+        summary = ExportSummary(files=files, seconds=time.perf_counter() - start)
+        LOG.info('archived {} topologies as {} in {:.2f}s ({:.1f} models/s)'.format(
+            len(files), format, summary.seconds, summary.throughput))
+        self._log_instrumentation()
+        return summary
+
+    def simulate_all(self, start: float, end: float, points: int,
+                     selections: typing.Optional[typing.List[str]] = None,
+                     workers: typing.Optional[int] = None, chunksize: typing.Optional[int] = None,
+                     topologies: typing.Optional[typing.Iterable[int]] = None,
+                     stack: bool = False, deduplicate: bool = False
+                     ) -> typing.Union[typing.Iterator[typing.Tuple[int, numpy.ndarray]], SimulationResults]:
+        """
+        Compile and simulate every topology using a pool of worker processes.
+
+        Each worker builds, compiles and simulates its topologies from
+        their IDs and only the resulting numpy arrays are sent back.
+        Topologies that fail to simulate are logged and reported as None
+        rather than stopping the batch.
+
+        Args:
+            start:
+                Simulation start time
+            end:
+                Simulation end time
+            points:
+                Number of time points
+            selections:
+                Columns to return, i.e. `['time', '[A]']`. Defaults to
+                roadrunner's default selections. Required when `stack` is True.
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 1 to simulate in the current process.
+            chunksize:
+                Number of topologies handed to a worker at a time
+            topologies:
+                IDs of the topologies to simulate. Defaults to all of them.
+            stack:
+                When False (default), return an iterator over
+                `(topology, numpy.ndarray)` pairs as they complete. When True,
+                wait for all simulations and return :py:class:`SimulationResults`
+            deduplicate:
+                Simulate only one topology of each of the
+                :py:meth:`equivalence_classes` and report its result for every
+                topology in the class. When streaming, those topologies share
+                the same array.
+
+        Returns:
+            An iterator of `(topology, numpy.ndarray)` or :py:class:`SimulationResults`
+        """
+        if stack and selections is None:
+            raise ValueError('selections are required to stack simulation results')
+        if topologies is None:
+            topologies = range(len(self))
+
+        if deduplicate:
+            classes = {ids[0]: ids for ids in self.equivalence_classes(topologies).values()}
+            topologies = list(classes)
+
+        results = parallel.map_topologies(self, _simulate_topology, topologies,
+                                          args=(start, end, points, selections),
+                                          workers=workers, chunksize=chunksize)
+        if deduplicate:
+            results = ((i, array) for topology, array in results for i in classes[topology])
+        if not stack:
+            return self._log_when_done(results)
+
+        results = sorted(results, key=lambda x: x[0])
+        data = numpy.full((len(results), points, len(selections)), numpy.nan)
+        for i, (topology, array) in enumerate(results):
+            if array is not None:
+                data[i] = array
+        self._log_instrumentation()
+        return SimulationResults(topologies=numpy.array([i[0] for i in results], dtype=int),
+                                 selections=list(selections), data=data)
+
+    def _log_when_done(self, results: typing.Iterator) -> typing.Iterator:
+        # stream the results and report the timings once they are all in
+        yield from results
+        self._log_instrumentation()
+
+    def _simulate(self, r: 'roadrunner.RoadRunner', start: float, end: float, points: int,
+                  selections: typing.Optional[typing.List[str]] = None) -> numpy.ndarray:
+        """
+        Simulate a compiled model. Kept apart from building and compiling
+        so that it is timed as its own stage.
+        """
+        if selections is None:
+            return numpy.array(r.simulate(start, end, points))
+        return numpy.array(r.simulate(start, end, points, selections))
+
+    def to_copasi(self) -> 'model.Model':
         """
         Build a copasi file from the sbml generated from tellurium
         
         Returns:
             A :py:class:`tasks.Model`
         """
-        return model.loada(self.to_antimony(), self.copasi_file)
+        return self._to_copasi(self.to_antimony(), self.copasi_file)
 
-    def get_topologies(self) -> pandas.DataFrame:
+    def to_copasi_all(self, workers: typing.Optional[int] = None, chunksize: typing.Optional[int] = None,
+                      topologies: typing.Optional[typing.Iterable[int]] = None) -> typing.List[CopasiResult]:
+        """
+        Build a copasi file for every topology using a pool of worker processes.
+
+        Each worker builds the antimony of its chunk of topologies
+        incrementally with an :py:class:`AntimonyBuilder` and converts it
+        to :py:attr:`copasi_file`. Conversions that fail are logged and
+        reported rather than stopping the batch.
+
+        >>> results = c.to_copasi_all(workers=8)
+        >>> failed = [i for i in results if i.error is not None]
+
+        Args:
+            workers:
+                Number of worker processes. Defaults to the number of CPUs.
+                Use 1 to convert in the current process.
+            chunksize:
+                Number of topologies handed to a worker at a time
+            topologies:
+                IDs of the topologies to convert. Defaults to all of them.
+
+        Returns:
+            list of :py:class:`CopasiResult`, in ascending order of topology
+        """
+        if topologies is None:
+            topologies = range(len(self))
+
+        start = time.perf_counter()
+        results = sorted(parallel.map_chunks(self, _copasi_topologies, topologies,
+                                             workers=workers, chunksize=chunksize))
+        failed = sum(1 for i in results if i.error is not None)
+        LOG.info('converted {} topologies to copasi in {:.2f}s, {} failed'.format(
+            len(results) - failed, time.perf_counter() - start, failed))
+        self._log_instrumentation()
+        return results
+
+    def _to_copasi(self, antimony: str, copasi_file: str) -> 'model.Model':
+        from pycotools3 import model
+        os.makedirs(os.path.dirname(copasi_file), exist_ok=True)
+        return model.loada(antimony, copasi_file)
+
+    def get_topologies(self) -> 'pandas.DataFrame':
         """
         Retrieve the topology indexes and the hypotheses
         contained within them. This is your map between
@@ -603,28 +2223,191 @@ class Combinations:
             A pandas.DataFrame
 
         """
-        topologies = OrderedDict()
-        comb = self._get_combinations()
-
-        for i in comb:
-            if i == ():
-                topologies[i] = 'Null'
-            else:
-                topologies[i] = '__'.join([self.topology_names[x].strip() for x in i])
-        # print(topologies)
-        df = pandas.DataFrame(topologies, index=['Topology']).transpose().reset_index(drop=True)
+        import pandas
+        if len(self.model_variant_reactions) > 63:
+            labels = ['__'.join([self.topology_names[x].strip() for x in i]) or 'Null'
+                      for i in self._get_combinations()]
+        else:
+            # labels are looked up from tables of every combination of 10
+            # hypotheses at a time, rather than joined topology by topology
+            masks = self.topology_masks()
+            names = [self.topology_names[i].strip() for i in range(len(self.topology_names))]
+            labels = numpy.full(masks.shape, '', dtype=object)
+            for start in range(0, len(names), 10):
+                chunk = names[start:start + 10]
+                table = numpy.array([''.join('__' + name for j, name in enumerate(chunk) if m >> j & 1)
+                                     for m in range(1 << len(chunk))], dtype=object)
+                bits = (masks >> numpy.uint64(start)) & numpy.uint64((1 << len(chunk)) - 1)
+                labels = labels + table[bits.astype(numpy.intp)]
+            labels = [i[2:] or 'Null' for i in labels.tolist()]
+        df = pandas.DataFrame({'Topology': labels})
         df.index.name = 'ModelID'
         return df
 
-    def to_roadrunner(self) -> rr.ExecutableModel:
+    def topology_masks(self) -> numpy.ndarray:
+        """
+        The hypotheses of every topology as a packed bitmask column.
+
+        Element i is a uint64 whose bit j is set when topology i contains
+        hypothesis j (the key of `topology_names`). Computed with
+        :py:meth:`TopologyIndex.masks` on first access and cached. Only
+        available for up to 63 hypotheses.
+
+        Returns:
+            numpy.ndarray of uint64, one element per topology
+        """
+        if self._masks is None:
+            self._masks = self._enumerate_masks()
+            self._masks.flags.writeable = False
+        return self._masks
+
+    def _enumerate_masks(self) -> numpy.ndarray:
+        return self.topology_index.masks()
+
+    def topology_matrix(self) -> numpy.ndarray:
+        """
+        The hypotheses of every topology as a boolean matrix of shape
+        (topologies, hypotheses). Column j corresponds to hypothesis j,
+        i.e. `topology_names[j]`. Unpacked from :py:meth:`topology_masks`
+        on each call.
+
+        Returns:
+            numpy.ndarray of bool
+        """
+        bits = numpy.arange(len(self.model_variant_reactions), dtype=numpy.uint64)
+        return (self.topology_masks()[:, None] >> bits) & numpy.uint64(1) == 1
+
+    def _hypothesis_lookup(self) -> typing.Dict[str, int]:
+        """
+        Map both the :py:attr:`HypothesisExtension.name` and the method
+        name without the `extension_hypothesis__` prefix to the
+        hypothesis index
+        """
+        lookup = {}
+        for k, v in self.model_variant_reactions.items():
+            lookup.setdefault(v.name, k)
+            lookup.setdefault(self.topology_names[k], k)
+        return lookup
+
+    def _hypothesis_indices(self, hypotheses: typing.Iterable[str]) -> typing.List[int]:
+        lookup = self._hypothesis_lookup()
+        if isinstance(hypotheses, str):
+            hypotheses = [hypotheses]
+        indices = []
+        for i in hypotheses:
+            if i not in lookup:
+                raise ValueError('"{}" is not a hypothesis. Choose from {}'.format(
+                    i, list(self.topology_names.values())))
+            indices.append(lookup[i])
+        return indices
+
+    def _hypothesis_mask(self, hypotheses: typing.Iterable[str]) -> int:
+        mask = 0
+        for i in self._hypothesis_indices(hypotheses):
+            mask |= 1 << i
+        return mask
+
+    def find(self, hypotheses: typing.Iterable[str]) -> int:
+        """
+        The topology ID of the model with exactly these hypotheses.
+
+        The inverse of :py:meth:`get_hypotheses`. The ID is computed with
+        :py:meth:`TopologyIndex.rank` in O(k) for k hypotheses, without
+        enumerating the topology space.
+
+        >>> c.find(['feedback1', 'additive2'])
+        10
+
+        Args:
+            hypotheses:
+                Hypothesis names, either the :py:attr:`HypothesisExtension.name`
+                or the method name without the `extension_hypothesis__` prefix.
+                An empty list or `['Null']` is the core model.
+
+        Returns:
+            int
+        """
+        if isinstance(hypotheses, str):
+            hypotheses = [hypotheses]
+        hypotheses = [i for i in hypotheses if i != 'Null']
+        return self.topology_index.rank(self._hypothesis_indices(hypotheses))
+
+    def topologies_containing(self, hypotheses: typing.Union[str, typing.Iterable[str]]) -> numpy.ndarray:
+        """
+        IDs of every topology that contains the given hypothesis, or
+        all of the given hypotheses when a list is passed.
+
+        >>> c.topologies_containing('feedback1')
+        array([ 3,  7, 10, 13, 15, 18, 20, 22])
+
+        Args:
+            hypotheses: a hypothesis name or a list of names
+
+        Returns:
+            numpy.ndarray of topology IDs
+        """
+        if len(self.model_variant_reactions) <= 63:
+            return self.query(include=hypotheses)
+        mask = self._hypothesis_mask(hypotheses)
+        index = self.topology_index
+        return numpy.array([i for i, subset in enumerate(index)
+                            if sum(1 << j for j in subset) & mask == mask], dtype=int)
+
+    def query(self, include: typing.Iterable[str] = (), exclude: typing.Iterable[str] = ()) -> numpy.ndarray:
+        """
+        IDs of the topologies that contain all of the `include` hypotheses
+        and none of the `exclude` hypotheses. Hypotheses are named either by
+        their :py:attr:`HypothesisExtension.name` or by the method name without
+        the `extension_hypothesis__` prefix.
+
+        The query runs vectorized over :py:meth:`topology_masks`.
+
+        >>> c.query(include=['feedback1'], exclude=['replace_reaction'])
+        array([ 3,  7, 10, 15])
+
+        Args:
+            include: hypotheses that must be in the topology
+            exclude: hypotheses that must not be in the topology
+
+        Returns:
+            numpy.ndarray of topology IDs
+        """
+        include = numpy.uint64(self._hypothesis_mask(include))
+        exclude = numpy.uint64(self._hypothesis_mask(exclude))
+        masks = self.topology_masks()
+        return numpy.flatnonzero(((masks & include) == include) & ((masks & exclude) == 0))
+
+    def to_roadrunner(self) -> 'roadrunner.RoadRunner':
         """
         Construct a roadrunner model via the tellurium
-        interface using the current antimony string
+        interface using the current antimony string. When
+        a `model_cache` was given, compiled models are
+        reused from the cache.
 
         Returns:
 
         """
-        return te.loada(self.to_antimony())
+        return self._to_roadrunner(self.to_antimony())
+
+    def _to_roadrunner(self, antimony: str) -> 'roadrunner.RoadRunner':
+        if self.model_cache is not None:
+            return self.model_cache.roadrunner(antimony)
+        import tellurium as te
+        return te.loada(antimony)
+
+    def to_sbml(self) -> str:
+        """
+        Construct the sbml string for the current topology
+        Returns:
+
+        """
+        return self._to_sbml(self.to_antimony())
+
+    def _to_sbml(self, antimony: str) -> str:
+        if self.model_cache is not None:
+            return self.model_cache.sbml(antimony)
+        import tellurium as te
+        return te.antimonyToSBML(antimony)
 
     def to_antimony(self) -> str:
         """
@@ -640,12 +2423,7 @@ class Combinations:
         Returns:
 
         """
-        all_parameters = self.core__parameters().split('\n')
-        all_parameters = [i.strip() for i in all_parameters]
-        all_parameters = [re.findall('^\w+', i) for i in all_parameters]
-        all_parameters = [i for i in all_parameters if i != []]
-        all_parameters = [i[0] for i in all_parameters]
-        return all_parameters
+        return self.core_template.parameter_names
 
     def get_hypotheses(self) -> typing.List[str]:
         """
@@ -653,7 +2431,13 @@ class Combinations:
         Returns:
 
         """
-        return self.get_topologies().loc[self.topology][0].split('__')
+        return self._hypotheses(self.topology)
+
+    def _hypotheses(self, topology: int) -> typing.List[str]:
+        comb = self.topology_index.unrank(topology)
+        if comb == ():
+            return ['Null']
+        return [self.topology_names[x].strip() for x in comb]
 
     def get_reaction_names(self) -> typing.List[str]:
         """
@@ -661,126 +2445,164 @@ class Combinations:
         Returns:
             List of reaction names in current model
         """
-        reactions = self.core__reactions().split('\n')
-        reactions = [i.strip() for i in reactions]
-        reactions = [i for i in reactions if i]
-        reactions = [i for i in reactions if not i.startswith('//')]
-        names = [re.findall('(.*):', i)[0] for i in reactions]
-        return names
+        return list(self.core_template.reactions)
 
     def _get_combinations(self) -> typing.List[typing.Tuple[int]]:
         """
-        Identify all possible combinations of model hypothesis
+        Identify all possible combinations of model hypothesis.
+
+        This materializes the full list of combinations and is only
+        needed when every topology is wanted at once. Single topologies
+        are looked up with :py:attr:`topology_index` instead. The list is
+        computed on first access and then cached on the instance.
+
         Returns:
 
         """
-        # convert mutually exclusive reactions to numerical value
-        mut_excl_list = []
-        for mi1, mi2 in self.mutually_exclusive_reactions:
-            l2 = []
-            for k, v in self.model_variant_reactions.items():
-                mi1_match = re.findall('^' + mi1, str(v))
-                mi2_match = re.findall('^' + mi2, str(v))
-
-                if mi1_match:
-                    l2.append(k)
-
-                if mi2_match:
-                    l2.append(k)
-
-            if len(l2) == 1:
-                raise ValueError('Cannot have a single reaction '
-                                 'in a mutually exclusive pair. Please'
-                                 'check that all reactions mentioned '
-                                 'in the `mutually_exclusive_reactions` argument'
-                                 'actually exist. ')
-            mut_excl_list.append(l2)
-
-        # Now that we have the list of MI reactions corresponding to integers, tackle finding the subset
-        perm_list = []
-        for i in range(len(self.model_variant_reactions)):
-            perm_list += [j for j in combinations(range(len(self.model_variant_reactions)), i)]
-        # we now need to remove any reaction that contains both parts of a mutually exclusive reaction couple
-        perm_list2 = []
-        for model_comb in perm_list:
-            # when we have no mutually exclusive reactions
-            if not mut_excl_list:
-                perm_list2.append(model_comb)
-            else:
-                # when we have mutually exclusive reactions, filter them out
-                for mi1, mi2 in mut_excl_list:
-                    if mi1 in model_comb and mi2 in model_comb:
-                        continue
-                    perm_list2.append(model_comb)
-        return perm_list2
+        if self._combinations is None:
+            self._combinations = list(self.topology_index)
+        return self._combinations
+
+    @property
+    def core_template(self) -> CoreTemplate:
+        """
+        The parsed core model, shared by every topology. Built
+        from the `core__` methods on first access.
+
+        Returns:
+            :py:class:`CoreTemplate`
+        """
+        if self._template is None:
+            self._template = CoreTemplate.from_combinations(self)
+        return self._template
+
+    @property
+    def topology_index(self) -> TopologyIndex:
+        """
+        The :py:class:`TopologyIndex` that maps topology IDs to
+        hypothesis indices and back. Built on first access and
+        rebuilt when `mutually_exclusive_reactions`, `constraints`,
+        `min_hypotheses`, `max_hypotheses` or `model_variant_reactions`
+        are reassigned.
+
+        Returns:
+            :py:class:`TopologyIndex`
+        """
+        if self._index is None:
+            self._index = self._build_topology_index()
+        return self._index
+
+    def _build_topology_index(self) -> TopologyIndex:
+        return TopologyIndex(len(self.model_variant_reactions),
+                             exclusive=self._mutually_exclusive_indices(),
+                             min_size=self.min_hypotheses, max_size=self.max_hypotheses,
+                             **self._constraint_indices())
+
+    def _constraint_indices(self) -> typing.Dict[str, list]:
+        """
+        Compile `constraints` into the keyword arguments of
+        :py:class:`TopologyIndex`
+        """
+        def indices(names):
+            if names is None:
+                return tuple(range(len(self.model_variant_reactions)))
+            return tuple(self._hypothesis_indices(names))
+
+        arguments = {}
+        for constraint in self.constraints:
+            for key, value in constraint.compile(indices).items():
+                arguments.setdefault(key, []).extend(value)
+        return arguments
+
+    def _mutually_exclusive_indices(self) -> typing.List[typing.Tuple[int, ...]]:
+        """
+        Convert the names in `mutually_exclusive_reactions` into
+        hypothesis indices. Names are matched against either the
+        :py:attr:`HypothesisExtension.name` or the method name without
+        the `extension_hypothesis__` prefix.
+
+        Returns:
 
-    def _build_reactions(self) -> str:
+        """
+        lookup = self._hypothesis_lookup()
+
+        mut_excl_list = []
+        for group in self.mutually_exclusive_reactions or []:
+            missing = [i for i in group if i not in lookup]
+            if missing:
+                raise ValueError('Cannot find hypotheses {} from mutually exclusive group {}. Please '
+                                 'check that all reactions mentioned in the `mutually_exclusive_reactions` '
+                                 'argument actually exist.'.format(missing, group))
+            mut_excl_list.append(tuple(lookup[i] for i in group))
+        return mut_excl_list
+
+    def _build_reactions(self, topology: typing.Optional[int] = None) -> str:
         """
         Build reactions using two mechanisms. 1) additive. When a HypothesisExtension class is marked as
         additive we can simply add the reaction to the bottom of the list of reactions. 2) replace. Alternatively
         we can replace an existing reaction with the hypothesis
+
+        Args:
+            topology: the topology to build. Defaults to the current topology
+
         Returns:
 
         """
-        reactions = self.core__reactions().split('\n')
-        reactions = [i.strip() for i in reactions]
-        # print(reactions)
-        # get additional reactions for current topology
-
-        hypotheses_needed = self._get_combinations()[self._topology]
+        if topology is None:
+            topology = self._topology
+        template = self.core_template
+        hypotheses_needed = self.topology_index.unrank(topology)
         hypotheses_needed = [self.model_variant_reactions[i] for i in hypotheses_needed]
-        replacements = [i.to_replace for i in hypotheses_needed]
-        s = ''
-        for reaction in reactions:
-            ## reaction name is always the first word, without the colon
-            reaction_name = re.findall('^\w+', reaction)
-
-            if reaction_name == []:
-                s += '\t' + reaction + '\n'
-                # continue
-
-            elif reaction_name[0] in replacements:
-                # get index of the reaction we want to replace
-                idx = replacements.index(reaction_name[0])
-                replacement_reaction = hypotheses_needed[idx]
-                s += '\t' + str(replacement_reaction) + '\n'
-            elif reaction_name[0] not in replacements:
-                s += '\t' + reaction + '\n'
-            else:
-                raise ValueError('This should not happen')
+
+        # the first hypothesis that names a reaction replaces it
+        replacements = {}
+        for i in hypotheses_needed:
+            if i.to_replace is not None:
+                replacements.setdefault(i.to_replace, '\t' + str(i) + '\n')
+
+        if replacements:
+            s = [replacements.get(name, line) if name is not None else line
+                 for name, line in zip(template.reaction_line_names, template.reaction_lines)]
+        else:
+            s = list(template.reaction_lines)
 
         # now add the additional extention hypotheses marked as additive
         for i in hypotheses_needed:
             if i.mode == 'additive':
-                s += str(i) + '\n'
-        return s
+                s.append(str(i) + '\n')
+        return ''.join(s)
 
-    def _build_antimony(self) -> str:
-        """
+    def _build_antimony(self, topology: typing.Optional[int] = None) -> str:
         """
-        s = ''
-        s += self.core__functions()
-        s += 'model {}Topology{}'.format(self.__class__.__name__, self.topology)
-        s += self.core__variables()
-        s += self._build_reactions()
+        Assemble the antimony string for a topology in a single pass.
 
-        s += self.core__parameters()
+        The core sections are spliced in from :py:attr:`core_template`.
+        Reactions are built once and tokenized into a set of identifiers,
+        ignoring comments. :py:meth:`CoreTemplate.live_symbols` adds the
+        identifiers used by events and, transitively, by the values and
+        assignment rules of live parameters. Declarations in the parameter
+        block whose name is not live are dropped.
 
-        if self.core__events():
-            s += self.core__events()
-        if self.core__units():
-            s += self.core__units()
-        s += "\nend"
-
-        # we now need to remove any global parameters that are not used in the current model topology
-        # todo find a better solution for this bit
-        exclude_list = ['Cell']  # we want to keep these
+        Args:
+            topology: the topology to build. Defaults to the current topology
 
-        for useless_parameter in self.get_parameters_as_list():
-            if useless_parameter not in self._build_reactions():
-                if useless_parameter not in exclude_list:
-                    s = re.sub(useless_parameter + '.*\n', '', s)
-        return s
+        Returns:
+            str
+        """
+        if topology is None:
+            topology = self._topology
+        template = self.core_template
+        reactions = self._build_reactions(topology)
+        live = template.live_symbols(_identifiers(reactions) | set(self.keep_parameters))
+
+        s = [
+            template.functions,
+            'model {}Topology{}'.format(self.__class__.__name__, topology),
+            template.variables,
+            reactions,
+        ]
+        s += [template.parameter_block(live), template.events, template.units, "\nend"]
+        return ''.join(s)
 
     def _default_parameter_set_as_dict(self) -> typing.Dict[str, float]:
         string = self.core__parameters()
@@ -924,3 +2746,153 @@ class Combinations:
 
         """
         return None
+
+
+class TopologyView:
+    """
+    A lightweight handle on a single topology of a :py:class:`Combinations`.
+
+    Holds only a reference to the parent :py:class:`Combinations` and the
+    topology ID, so lists of views are cheap even for very large topology
+    spaces. Views are returned when slicing a :py:class:`Combinations` and
+    by :py:meth:`Combinations.to_list` and :py:meth:`Combinations.items`.
+    They never modify the `topology` attribute of their parent.
+
+    Other attributes are looked up on the parent. Those defined by
+    :py:class:`Combinations` itself, such as `directory`, `topology_names`
+    or :py:meth:`Combinations.get_topologies`, do not depend on the
+    topology and are taken from the parent as they are. Methods and
+    properties added by a subclass are bound to the view instead, so
+    that they see the view's topology:
+
+    >>> class MyCombModel(Combinations):
+    >>>     def model_name(self):
+    >>>         return 'Topology{}'.format(self.topology)
+    >>> [i.model_name() for i in c[3:5]]
+    ['Topology3', 'Topology4']
+
+    >>> view = c[:5][3]
+    >>> view
+    MyCombModel(topology=3)
+    >>> view.get_hypotheses()
+    ['feedback1']
+    """
+    __slots__ = ('parent', 'topology')
+
+    def __init__(self, parent: Combinations, topology: int) -> None:
+        self.parent = parent
+        self.topology = topology
+
+    def __getattr__(self, name):
+        # only called for attributes the view does not define itself. Dunder
+        # names are not forwarded so that protocols like pickling and copying
+        # are not delegated to the parent.
+        if name.startswith('__') or name == 'parent':
+            raise AttributeError('{!r} object has no attribute {!r}'.format(self.__class__.__name__, name))
+        cls = type(self.parent)
+        for klass in cls.__mro__:
+            if klass is Combinations:
+                break
+            if name in vars(klass):
+                attr = vars(klass)[name]
+                # methods and properties of the subclass may use the topology
+                return attr.__get__(self, cls) if hasattr(attr, '__get__') else attr
+        return getattr(self.parent, name)
+
+    def __str__(self):
+        return "{}(topology={})".format(self.parent.__class__.__name__, self.topology)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __eq__(self, other):
+        if not isinstance(other, TopologyView):
+            return NotImplemented
+        return self.parent is other.parent and self.topology == other.topology
+
+    def __hash__(self):
+        return hash((id(self.parent), self.topology))
+
+    @property
+    def topology_dir(self) -> str:
+        """
+        See :py:attr:`Combinations.topology_dir`
+        """
+        return self.parent._topology_dir(self.topology)
+
+    @property
+    def time_course_graphs(self) -> str:
+        """
+        See :py:attr:`Combinations.time_course_graphs`
+        """
+        return self.parent._time_course_graphs(self.topology)
+
+    @property
+    def copasi_file(self) -> str:
+        """
+        See :py:attr:`Combinations.copasi_file`
+        """
+        return self.parent._topology_file(self.topology, 'cps')
+
+    @property
+    def cps_file(self) -> str:
+        """
+        The `cps_file` attribute of :py:class:`Combinations`, for this topology
+        """
+        return os.path.join(self.topology_dir, 'Topology{}'.format(self.topology))
+
+    @property
+    def antimony_file(self) -> str:
+        """
+        See :py:attr:`Combinations.antimony_file`
+        """
+        return self.parent._topology_file(self.topology, 'ant')
+
+    @property
+    def sbml_file(self) -> str:
+        """
+        See :py:attr:`Combinations.sbml_file`
+        """
+        return self.parent._topology_file(self.topology, 'xml')
+
+    def to_antimony(self) -> str:
+        """
+        See :py:meth:`Combinations.to_antimony`
+        """
+        return self.parent._build_antimony(self.topology)
+
+    def to_sbml(self) -> str:
+        """
+        See :py:meth:`Combinations.to_sbml`
+        """
+        return self.parent._to_sbml(self.to_antimony())
+
+    def to_roadrunner(self) -> 'roadrunner.RoadRunner':
+        """
+        See :py:meth:`Combinations.to_roadrunner`
+        """
+        return self.parent._to_roadrunner(self.to_antimony())
+
+    def to_copasi(self) -> 'model.Model':
+        """
+        See :py:meth:`Combinations.to_copasi`
+        """
+        return self.parent._to_copasi(self.to_antimony(), self.copasi_file)
+
+    def get_hypotheses(self) -> typing.List[str]:
+        """
+        See :py:meth:`Combinations.get_hypotheses`
+        """
+        return self.parent._hypotheses(self.topology)
+
+    def get_reaction_names(self) -> typing.List[str]:
+        """
+        See :py:meth:`Combinations.get_reaction_names`
+        """
+        return self.parent.get_reaction_names()
+
+    def get_parameters_as_list(self) -> typing.List[str]:
+        """
+        See :py:meth:`Combinations.get_parameters_as_list`
+        """
+        return self.parent.get_parameters_as_list()
@@ -0,0 +1,156 @@
+"""
+Storage of many topologies in a single zip archive.
+
+Writing one file per topology creates a directory per topology, which
+does not scale to very large topology spaces on shared filesystems.
+:py:meth:`Combinations.export_archive` writes every model into a single
+zip file instead, alongside a json manifest that maps topology IDs to
+their hypotheses and archive members. :py:class:`TopologyArchive` reads
+it back with random access by topology ID.
+"""
+import json
+import os
+import tempfile
+import typing
+import zipfile
+
+MANIFEST = 'manifest.json'
+
+EXTENSIONS = {'antimony': 'ant', 'sbml': 'xml'}
+
+
+class TopologyArchive:
+    """
+    Read access to an archive written by :py:meth:`Combinations.export_archive`
+
+    Examples:
+
+        >>> c.export_archive('/path/to/models.zip', format='sbml')
+        >>> with TopologyArchive('/path/to/models.zip') as archive:
+        >>>     sbml = archive[1234]
+        >>>     archive.hypotheses(1234)
+        ('additive2', 'feedback1')
+        >>>     archive.extract(1234, '/path/to/project')
+        '/path/to/project/Topology1234/topology1234.xml'
+
+    Only the zip directory and the manifest are read when the archive
+    is opened. Models are decompressed one at a time as they are accessed.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+
+        Args:
+            path: path to the zip archive
+        """
+        self.path = path
+        self._zip = zipfile.ZipFile(path, 'r')
+        manifest = json.loads(self._zip.read(MANIFEST).decode('utf-8'))
+        #: name of the :py:class:`Combinations` subclass the models were built from
+        self.model = manifest['model']
+        #: either 'antimony' or 'sbml'
+        self.format = manifest['format']
+        self._entries = {i['topology']: i for i in manifest['topologies']}
+
+    def __enter__(self) -> 'TopologyArchive':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._entries)
+
+    def __contains__(self, topology: int) -> bool:
+        return topology in self._entries
+
+    def __getitem__(self, topology: int) -> str:
+        return self._zip.read(self._entry(topology)['file']).decode('utf-8')
+
+    def _entry(self, topology: int) -> dict:
+        try:
+            return self._entries[topology]
+        except KeyError:
+            raise KeyError('topology {} is not in {}'.format(topology, self.path))
+
+    @property
+    def topologies(self) -> typing.List[int]:
+        """
+        IDs of the topologies in the archive, in ascending order
+        """
+        return list(self._entries)
+
+    def hypotheses(self, topology: int) -> typing.Tuple[str, ...]:
+        """
+        Names of the hypothesis extensions in a topology. Empty
+        for the core model.
+        """
+        return tuple(self._entry(topology)['hypotheses'])
+
+    def extract(self, topology: int, directory: typing.Optional[str] = None) -> str:
+        """
+        Write a single model to `directory/Topology{topology}`, the
+        same layout used by :py:meth:`Combinations.export_all`
+
+        Args:
+            topology: topology ID
+            directory: defaults to the directory containing the archive
+
+        Returns:
+            path of the file that was written
+        """
+        if directory is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+        d = os.path.join(directory, 'Topology{}'.format(topology))
+        os.makedirs(d, exist_ok=True)
+        fname = os.path.join(d, self._entry(topology)['file'])
+        with open(fname, 'w') as f:
+            f.write(self[topology])
+        return fname
+
+    def close(self) -> None:
+        self._zip.close()
+
+    @staticmethod
+    def write(path: str, models: typing.Iterable[typing.Tuple[int, typing.Tuple[str, ...], str]],
+              format: str, model: str) -> typing.List[str]:
+        """
+        Write models into a new archive at `path`, replacing any
+        existing file only once the archive is complete
+
+        Args:
+            path: path of the zip archive
+            models: iterable of `(topology, hypotheses, content)` tuples, in any order
+            format: either 'antimony' or 'sbml'
+            model: name of the :py:class:`Combinations` subclass
+
+        Returns:
+            names of the archive members that were written
+        """
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d, suffix='.tmp')
+        os.close(fd)
+        entries = []
+        try:
+            with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for topology, hypotheses, content in models:
+                    # IDs from numpy arrays, i.e. Combinations.query, are not json serializable
+                    topology = int(topology)
+                    fname = 'topology{}.{}'.format(topology, EXTENSIONS[format])
+                    archive.writestr(fname, content)
+                    entries.append({'topology': topology, 'hypotheses': list(hypotheses), 'file': fname})
+                entries.sort(key=lambda x: x['topology'])
+                manifest = {'model': model, 'format': format, 'topologies': entries}
+                archive.writestr(MANIFEST, json.dumps(manifest))
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return [i['file'] for i in entries]
@@ -0,0 +1,204 @@
+"""
+Caching of generated SBML and compiled roadrunner models.
+
+Models are keyed by a hash of their antimony string, so the cache is
+shared by any topology (or any :py:class:`Combinations` instance) that
+produces the same model. Pass a :py:class:`ModelCache` to
+:py:class:`Combinations` to use it from :py:meth:`Combinations.to_sbml`
+and :py:meth:`Combinations.to_roadrunner`.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+
+if typing.TYPE_CHECKING:
+    import roadrunner
+
+LOG = logging.getLogger(__name__)
+
+
+class CacheInfo(typing.NamedTuple):
+    """
+    Statistics returned by :py:meth:`ModelCache.cache_info`
+    """
+    #: roadrunner models served from memory
+    hits: int
+    #: sbml strings served from the on-disk cache
+    disk_hits: int
+    #: models that had to be converted from antimony
+    misses: int
+    #: roadrunner models dropped from memory to respect `maxsize`
+    evictions: int
+    #: number of roadrunner models currently held in memory
+    currsize: int
+    #: maximum number of roadrunner models held in memory
+    maxsize: int
+
+
+class ModelCache:
+    """
+    A persistent on-disk cache of sbml plus an in-memory least
+    recently used cache of loaded roadrunner models.
+
+    Examples:
+
+        >>> cache = ModelCache(directory='/path/to/cache', maxsize=64)
+        >>> c = MyCombModel(directory=project_root, model_cache=cache)
+        >>> r = c[3].to_roadrunner()    # converted, compiled and cached
+        >>> r = c[3].to_roadrunner()    # served from memory
+        >>> cache.cache_info()
+        CacheInfo(hits=1, disk_hits=0, misses=1, evictions=0, currsize=1, maxsize=64)
+
+    Roadrunner models are reset to their original state with
+    `resetToOrigin` before being handed out again, but the same instance
+    is returned to every caller. The cache itself can be used from
+    several threads, but a cached model should not be simulated from
+    two threads at once.
+    """
+
+    def __init__(self, directory: typing.Optional[str] = None, maxsize: int = 32) -> None:
+        """
+
+        Args:
+            directory:
+                Where to store sbml files. Defaults to None, in which
+                case nothing is written to disk.
+            maxsize:
+                Maximum number of roadrunner models kept in memory. Use 0
+                to disable the in-memory cache.
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.directory is not None and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __getstate__(self):
+        # roadrunner models stay in the process that compiled them
+        state = self.__dict__.copy()
+        state['_models'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __repr__(self):
+        return '{}(directory={}, maxsize={})'.format(self.__class__.__name__, self.directory, self.maxsize)
+
+    @staticmethod
+    def key(antimony: str) -> str:
+        """
+        The cache key for an antimony string
+        """
+        return hashlib.sha256(antimony.encode('utf-8')).hexdigest()
+
+    def _sbml_file(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.xml')
+
+    def sbml(self, antimony: str) -> str:
+        """
+        Get the sbml for an antimony string, converting it only if
+        it is not already in the on-disk cache
+
+        Args:
+            antimony: antimony string
+
+        Returns:
+            str
+        """
+        if self.directory is None:
+            with self._lock:
+                self.misses += 1
+            import tellurium as te
+            return te.antimonyToSBML(antimony)
+
+        fname = self._sbml_file(self.key(antimony))
+        if os.path.isfile(fname):
+            with self._lock:
+                self.disk_hits += 1
+            with open(fname) as f:
+                return f.read()
+
+        with self._lock:
+            self.misses += 1
+        import tellurium as te
+        sbml = te.antimonyToSBML(antimony)
+        d = os.path.dirname(fname)
+        if not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        # write then rename so concurrent workers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=d, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(sbml)
+        os.replace(tmp, fname)
+        return sbml
+
+    def roadrunner(self, antimony: str) -> 'roadrunner.RoadRunner':
+        """
+        Get a compiled roadrunner model for an antimony string
+
+        Args:
+            antimony: antimony string
+
+        Returns:
+            roadrunner.RoadRunner
+        """
+        key = self.key(antimony)
+        with self._lock:
+            r = self._models.get(key)
+            if r is not None:
+                self.hits += 1
+                self._models.move_to_end(key)
+                r.resetToOrigin()
+                return r
+
+        import roadrunner
+        r = roadrunner.RoadRunner(self.sbml(antimony))
+        if self.maxsize > 0:
+            with self._lock:
+                self._models[key] = r
+                while len(self._models) > self.maxsize:
+                    self._models.popitem(last=False)
+                    self.evictions += 1
+        return r
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Hit and miss statistics
+
+        Returns:
+            :py:class:`CacheInfo`
+        """
+        return CacheInfo(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                         evictions=self.evictions, currsize=len(self._models), maxsize=self.maxsize)
+
+    def clear(self, disk: bool = False) -> None:
+        """
+        Drop all roadrunner models held in memory and reset statistics
+
+        Args:
+            disk: also delete the sbml files from the on-disk cache
+        """
+        with self._lock:
+            self._models.clear()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if disk and self.directory is not None:
+            for root, dirs, files in os.walk(self.directory):
+                for fname in files:
+                    if fname.endswith('.xml'):
+                        os.remove(os.path.join(root, fname))
@@ -0,0 +1,69 @@
+"""
+Constraints that restrict which combinations of hypotheses are
+part of the topology space.
+
+Pass a list of constraints to :py:class:`Combinations` as the
+`constraints` argument. Hypotheses are referred to by their
+:py:attr:`HypothesisExtension.name` or by the method name without the
+`extension_hypothesis__` prefix, as in `mutually_exclusive_reactions`.
+Constraints are compiled into the :py:class:`TopologyIndex`, so
+topologies that break them are never enumerated and do not take up a
+topology ID.
+
+    >>> c = MyCombModel(constraints=[
+    >>>     Requires('Feedback2', 'Feedback1'),         # Feedback2 only with Feedback1
+    >>>     AtMost(3),                                  # at most three hypotheses per model
+    >>>     ExactlyOne(['additive1', 'additive2']),     # one or the other, never neither
+    >>>     Forbid(['Feedback1', 'Feedback2', 'ReplaceReaction']),
+    >>> ])
+"""
+import typing
+
+Names = typing.Union[str, typing.Sequence[str]]
+Indices = typing.Callable[[Names], typing.Tuple[int, ...]]
+
+
+class Requires(typing.NamedTuple):
+    """
+    `hypothesis` may only occur in a topology that also contains
+    at least one of `requires`
+    """
+    hypothesis: str
+    requires: Names
+
+    def compile(self, indices: Indices) -> typing.Dict[str, list]:
+        return {'requires': [(indices(self.hypothesis)[0], indices(self.requires))]}
+
+
+class Forbid(typing.NamedTuple):
+    """
+    The hypotheses of `group` may not all occur in the same
+    topology, although any fewer of them may
+    """
+    group: typing.Sequence[str]
+
+    def compile(self, indices: Indices) -> typing.Dict[str, list]:
+        return {'forbidden': [indices(self.group)]}
+
+
+class AtMost(typing.NamedTuple):
+    """
+    At most `k` of the hypotheses of `group` occur in the same
+    topology. When `group` is None, at most `k` hypotheses occur
+    in any topology.
+    """
+    k: int
+    group: typing.Optional[typing.Sequence[str]] = None
+
+    def compile(self, indices: Indices) -> typing.Dict[str, list]:
+        return {'cardinality': [(indices(self.group), 0, self.k)]}
+
+
+class ExactlyOne(typing.NamedTuple):
+    """
+    Every topology contains exactly one of the hypotheses of `group`
+    """
+    group: typing.Sequence[str]
+
+    def compile(self, indices: Indices) -> typing.Dict[str, list]:
+        return {'cardinality': [(indices(self.group), 1, 1)]}
@@ -0,0 +1,244 @@
+"""
+Opt-in timing of the stages of the build pipeline.
+
+Pass an :py:class:`Instrumentation` to :py:class:`Combinations` to time
+every call to the stages listed in `Combinations.instrumented_stages`.
+The stage methods are only wrapped while instrumentation is enabled, so
+there is no overhead when it is not.
+
+Each timed call is handed to an optional sink, such as a
+:py:class:`LoggingSink`, a :py:class:`CSVSink` or any callable taking
+the stage name, the time taken in seconds and whether the call raised.
+Work done in the worker processes of :py:meth:`Combinations.export_all`
+and friends is merged back into the instance in the calling process.
+Sinks are called in whichever process does the work, so they must be
+picklable when `workers` is more than 1.
+"""
+import csv
+import functools
+import logging
+import threading
+import time
+import typing
+
+LOG = logging.getLogger(__name__)
+
+Sink = typing.Callable[[str, float, bool], None]
+
+
+class StageStats(typing.NamedTuple):
+    """
+    Statistics for one stage, returned by :py:meth:`Instrumentation.summary`
+    """
+    #: number of calls
+    calls: int
+    #: number of calls that raised
+    errors: int
+    #: total time spent in the stage in seconds
+    total: float
+    #: fastest call in seconds
+    min: float
+    #: slowest call in seconds
+    max: float
+
+    @property
+    def mean(self) -> float:
+        """
+        Mean time per call in seconds
+        """
+        return self.total / self.calls if self.calls else 0.0
+
+
+class LoggingSink:
+    """
+    Log every timed call
+    """
+
+    def __init__(self, logger: str = __name__, level: int = logging.DEBUG) -> None:
+        """
+
+        Args:
+            logger: name of the logger to use
+            level: logging level of the messages
+        """
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, stage: str, seconds: float, error: bool) -> None:
+        logging.getLogger(self.logger).log(self.level, '{} took {:.6f}s{}'.format(
+            stage, seconds, ' and failed' if error else ''))
+
+
+class CSVSink:
+    """
+    Append every timed call to a csv file with columns
+    `time`, `stage`, `seconds` and `error`
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+
+        Args:
+            path: the csv file. Rows are appended if it exists.
+        """
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # each process opens its own handle
+        state = self.__dict__.copy()
+        state['_file'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', newline='')
+            csv.writer(self._file).writerow([time.time(), stage, seconds, int(error)])
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Instrumentation:
+    """
+    Per-stage timers and counters.
+
+    Examples:
+
+        >>> instrumentation = Instrumentation(sink=CSVSink('timings.csv'))
+        >>> c = MyCombModel(directory=project_root, instrumentation=instrumentation)
+        >>> c.export_all(format='sbml')
+        >>> print(instrumentation.report())
+                 stage    calls errors  total (s)  mean (ms)   min (ms)   max (ms)
+                to_sbml       24      0      1.032     43.003     38.112     61.950
+         build_antimony       24      0      0.006      0.250      0.198      0.701
+
+    Stages nest: time spent in `build_reactions` is also counted in
+    `build_antimony`, and so on.
+    """
+
+    def __init__(self, sink: typing.Optional[Sink] = None) -> None:
+        """
+
+        Args:
+            sink:
+                Optional callable taking the stage name, the time taken in
+                seconds and whether the call raised. Called once per timed call.
+        """
+        self.sink = sink
+        self._lock = threading.Lock()
+        # stage -> [calls, errors, total, min, max]
+        self._stats = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}(sink={})'.format(self.__class__.__name__, self.sink)
+
+    def record(self, stage: str, seconds: float, error: bool = False) -> None:
+        """
+        Record one call to `stage`
+
+        Args:
+            stage: name of the stage
+            seconds: time taken
+            error: whether the call raised
+        """
+        with self._lock:
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = [1, int(error), seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += int(error)
+                stats[2] += seconds
+                stats[3] = min(stats[3], seconds)
+                stats[4] = max(stats[4], seconds)
+        if self.sink is not None:
+            self.sink(stage, seconds, error)
+
+    def wrap(self, stage: str, func: typing.Callable) -> typing.Callable:
+        """
+        Wrap `func` so that every call is recorded as `stage`
+        """
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self.record(stage, time.perf_counter() - start, error=True)
+                raise
+            self.record(stage, time.perf_counter() - start)
+            return result
+        return timed
+
+    def summary(self) -> typing.Dict[str, StageStats]:
+        """
+        Statistics of every stage that was called, slowest in total first
+
+        Returns:
+            dict mapping stage name to :py:class:`StageStats`
+        """
+        with self._lock:
+            stats = [(stage, StageStats(*i)) for stage, i in self._stats.items()]
+        return dict(sorted(stats, key=lambda x: x[1].total, reverse=True))
+
+    def report(self) -> str:
+        """
+        The :py:meth:`summary` as a table
+        """
+        lines = ['{:>16} {:>8} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'calls', 'errors', 'total (s)', 'mean (ms)', 'min (ms)', 'max (ms)')]
+        for stage, i in self.summary().items():
+            lines.append('{:>16} {:>8} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                stage, i.calls, i.errors, i.total, i.mean * 1000, i.min * 1000, i.max * 1000))
+        return '\n'.join(lines)
+
+    def drain(self) -> typing.Dict[str, list]:
+        """
+        Remove and return the raw statistics, for :py:meth:`merge`
+        """
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+    def merge(self, stats: typing.Dict[str, list]) -> None:
+        """
+        Add statistics drained from another instance, i.e. in a worker process
+        """
+        with self._lock:
+            for stage, (calls, errors, total, fastest, slowest) in stats.items():
+                mine = self._stats.get(stage)
+                if mine is None:
+                    self._stats[stage] = [calls, errors, total, fastest, slowest]
+                else:
+                    mine[0] += calls
+                    mine[1] += errors
+                    mine[2] += total
+                    mine[3] = min(mine[3], fastest)
+                    mine[4] = max(mine[4], slowest)
+
+    def reset(self) -> None:
+        """
+        Forget all statistics
+        """
+        self.drain()
@@ -0,0 +1,140 @@
+"""
+Process pool helpers for running work over many topologies.
+
+A :py:class:`Combinations` instance is sent to each worker process
+once, when the worker starts, and the work itself is described by
+topology IDs only. Workers build whatever they need from their own
+copy of the instance, so no per-topology objects are pickled.
+
+The instance (and therefore its class) must be picklable. With the
+`spawn` start method this means the :py:class:`Combinations` subclass
+must be importable from a module rather than defined in `__main__`.
+"""
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# the Combinations instance owned by the current worker process
+_COMBINATIONS = None
+
+
+def _initializer(combinations) -> None:
+    global _COMBINATIONS
+    _COMBINATIONS = combinations
+    # only timings made in this worker are sent back
+    if combinations.instrumentation is not None:
+        combinations.instrumentation.reset()
+
+
+def _with_stats(results: list) -> typing.Tuple[list, typing.Optional[dict]]:
+    # hand the worker's timings back to be merged into the caller's instrumentation
+    instrumentation = _COMBINATIONS.instrumentation
+    return results, instrumentation.drain() if instrumentation is not None else None
+
+
+def _run_chunk(func: typing.Callable, topologies: typing.List[int], args: tuple) -> tuple:
+    return _with_stats([func(_COMBINATIONS, topology, *args) for topology in topologies])
+
+
+def _run_whole_chunk(func: typing.Callable, topologies: typing.List[int], args: tuple) -> tuple:
+    return _with_stats(func(_COMBINATIONS, topologies, *args))
+
+
+def _collect(combinations, futures: list) -> typing.Iterator:
+    for future in as_completed(futures):
+        results, stats = future.result()
+        if stats:
+            combinations.instrumentation.merge(stats)
+        yield from results
+
+
+def _stream(combinations, run: typing.Callable, func: typing.Callable,
+            chunks: typing.Iterable[typing.Sequence[int]], args: tuple, workers: int) -> typing.Iterator:
+    pool = ProcessPoolExecutor(workers, initializer=_initializer, initargs=(combinations,))
+    futures = []
+    wait = True
+    try:
+        futures = [pool.submit(run, func, chunk, args) for chunk in chunks]
+        yield from _collect(combinations, futures)
+    except GeneratorExit:
+        # the consumer stopped early. Drop the chunks that have not started
+        # rather than waiting for the whole batch, like
+        # shutdown(cancel_futures=True) in python 3.9
+        wait = False
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=wait)
+
+
+def chunked(topologies: typing.Sequence[int], chunksize: int) -> typing.Iterator[typing.Sequence[int]]:
+    """
+    Split `topologies` into consecutive chunks of at most `chunksize`
+    """
+    for start in range(0, len(topologies), chunksize):
+        yield topologies[start:start + chunksize]
+
+
+def map_topologies(combinations, func: typing.Callable, topologies: typing.Sequence[int],
+                   args: tuple = (), workers: typing.Optional[int] = None,
+                   chunksize: typing.Optional[int] = None) -> typing.Iterator:
+    """
+    Call `func(combinations, topology, *args)` for every topology
+    in a pool of worker processes.
+
+    Args:
+        combinations:
+            The :py:class:`Combinations` instance. Sent to each worker once.
+        func:
+            A module level (i.e. picklable) function.
+        topologies:
+            The topology IDs to process.
+        args:
+            Extra positional arguments for `func`.
+        workers:
+            Number of worker processes. Defaults to the number of CPUs. When
+            1, `func` is called in the current process without a pool.
+        chunksize:
+            Number of topologies sent to a worker at a time. Defaults to
+            splitting the work into about four chunks per worker.
+
+    Returns:
+        Iterator over the return values of `func`, in order of completion
+    """
+    topologies = list(topologies)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for topology in topologies:
+            yield func(combinations, topology, *args)
+        return
+
+    if chunksize is None:
+        chunksize = max(1, -(-len(topologies) // (workers * 4)))
+
+    yield from _stream(combinations, _run_chunk, func, chunked(topologies, chunksize), args, workers)
+
+
+def map_chunks(combinations, func: typing.Callable, topologies: typing.Sequence[int],
+               args: tuple = (), workers: typing.Optional[int] = None,
+               chunksize: typing.Optional[int] = None) -> typing.Iterator:
+    """
+    Like :py:func:`map_topologies`, but call `func(combinations, chunk, *args)`
+    once per chunk of topology IDs. `func` returns a list of results for
+    the chunk, which lets it carry state from one topology to the next.
+
+    Returns:
+        Iterator over the items of the lists returned by `func`, in
+        order of completion of the chunks
+    """
+    topologies = list(topologies)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunked(topologies, chunksize or max(1, len(topologies))):
+            yield from func(combinations, chunk, *args)
+        return
+
+    if chunksize is None:
+        chunksize = max(1, -(-len(topologies) // (workers * 4)))
+
+    yield from _stream(combinations, _run_whole_chunk, func, chunked(topologies, chunksize), args, workers)
@@ -0,0 +1,31 @@
+"""
+Per-model build time of :py:meth:`Combinations.to_antimony` against
+the number of parameters in the core model.
+
+Usage:
+
+    $ python benchmarks/build_antimony.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_model
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    print('{:>12} {:>16}'.format('parameters', 'ms per model'))
+    for n_parameters in [10, 50, 100, 500, 1000]:
+        cls, exclusive = make_model(n_hypotheses=4, n_parameters=n_parameters, n_reactions=n_parameters)
+        c = cls(directory=directory)
+        number = max(1, 2000 // n_parameters)
+        seconds = min(timeit.repeat(c.to_antimony, number=number, repeat=3)) / number
+        print('{:>12} {:>16.3f}'.format(n_parameters, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Time and peak memory of the main operations of :py:class:`Combinations`
+against the number of hypotheses (k), parameters (P), reactions (R) and
+mutually exclusive pairs (E), using the synthetic models in `synthetic.py`.
+
+Results are written as json so that two runs can be compared.
+
+Usage:
+
+    $ python benchmarks/suite.py --output before.json
+    $ python benchmarks/suite.py --output after.json --compare before.json
+    $ python benchmarks/suite.py --quick
+
+Operations:
+
+    enumerate       list every topology with `_get_combinations`
+    get_topologies  the hypotheses of every topology as a DataFrame
+    build_antimony  `_build_antimony` on a sample of topologies, per model
+    iter_antimony   incremental build of consecutive topologies, per model
+    to_roadrunner   compile a single topology
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_model
+
+# (k, P, R, E)
+SIZES = [(k, 100, 100, 0) for k in (4, 8, 12, 16)]
+SIZES += [(8, p, p, 0) for p in (10, 1000)]
+SIZES += [(12, 100, 100, e) for e in (2, 4)]
+
+QUICK_SIZES = [(4, 10, 10, 0), (8, 100, 100, 2)]
+
+# maximum number of models built by the per model operations
+SAMPLE = 200
+
+
+def _enumerate(cls, exclusive, directory):
+    c = cls(mutually_exclusive_reactions=exclusive, directory=directory)
+    return len(c._get_combinations())
+
+
+def _get_topologies(cls, exclusive, directory):
+    c = cls(mutually_exclusive_reactions=exclusive, directory=directory)
+    return len(c.get_topologies())
+
+
+def _build_antimony(cls, exclusive, directory):
+    c = cls(mutually_exclusive_reactions=exclusive, directory=directory)
+    n = len(c)
+    topologies = range(0, n, max(1, n // SAMPLE))
+    for topology in topologies:
+        c._build_antimony(topology)
+    return len(topologies)
+
+
+def _iter_antimony(cls, exclusive, directory):
+    c = cls(mutually_exclusive_reactions=exclusive, directory=directory)
+    topologies = range(min(len(c), SAMPLE))
+    for topology, antimony in c.iter_antimony(topologies):
+        pass
+    return len(topologies)
+
+
+def _to_roadrunner(cls, exclusive, directory):
+    c = cls(mutually_exclusive_reactions=exclusive, directory=directory)
+    c.view(len(c) // 2).to_roadrunner()
+    return 1
+
+
+OPERATIONS = {
+    'enumerate': _enumerate,
+    'get_topologies': _get_topologies,
+    'build_antimony': _build_antimony,
+    'iter_antimony': _iter_antimony,
+    'to_roadrunner': _to_roadrunner,
+}
+
+
+def measure(operation: typing.Callable, cls, exclusive, directory: str, repeat: int) -> dict:
+    """
+    Run `operation` `repeat` times for the best wall clock time, then
+    once more under tracemalloc for the peak memory, so that tracing
+    does not inflate the time.
+    """
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        items = operation(cls, exclusive, directory)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        operation(cls, exclusive, directory)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(seconds), 'items': items, 'seconds_per_item': min(seconds) / items, 'peak_bytes': peak}
+
+
+def run(sizes: typing.List[typing.Tuple[int, int, int, int]], operations: typing.List[str],
+        repeat: int) -> typing.List[dict]:
+    directory = tempfile.mkdtemp()
+    results = []
+    for k, p, r, e in sizes:
+        cls, exclusive = make_model(n_hypotheses=k, n_parameters=p, n_reactions=r, n_exclusive=e)
+        topologies = len(cls(mutually_exclusive_reactions=exclusive, directory=directory))
+        for name in operations:
+            try:
+                result = measure(OPERATIONS[name], cls, exclusive, directory, repeat)
+            except ImportError as err:
+                print('skipping {}: {}'.format(name, err), file=sys.stderr)
+                continue
+            result.update(operation=name, k=k, P=p, R=r, E=e, topologies=topologies)
+            results.append(result)
+            print('{operation:>16} k={k:<3} P={P:<5} R={R:<5} E={E:<3} {seconds:10.4f}s '
+                  '{seconds_per_item:10.6f}s/item {peak_bytes:>12,d}B'.format(**result))
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result['operation'], result['k'], result['P'], result['R'], result['E']
+
+
+def compare(results: typing.List[dict], baseline: typing.List[dict]) -> None:
+    """
+    Print the ratio of time and peak memory of `results` over `baseline`
+    for the cases that are in both
+    """
+    baseline = {_key(i): i for i in baseline}
+    print('\n{:>16} {:>24} {:>10} {:>10}'.format('operation', 'k/P/R/E', 'time', 'memory'))
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        print('{:>16} {:>24} {:>9.2f}x {:>9.2f}x'.format(
+            result['operation'], '/'.join(str(i) for i in _key(result)[1:]),
+            result['seconds_per_item'] / old['seconds_per_item'],
+            result['peak_bytes'] / max(1, old['peak_bytes'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write results to this json file')
+    parser.add_argument('--compare', help='json file of a previous run to compare against')
+    parser.add_argument('--quick', action='store_true', help='only run a couple of small sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats per operation, the best is kept')
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS), default=list(OPERATIONS))
+    args = parser.parse_args()
+
+    results = run(QUICK_SIZES if args.quick else SIZES, args.operations, args.repeat)
+
+    if args.output:
+        metadata = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        }
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': metadata, 'results': results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Synthetic :py:class:`Combinations` subclasses of arbitrary size, for
+the benchmarks in this directory.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from antimony_combinations import Combinations, HypothesisExtension
+
+
+def make_model(n_hypotheses: int, n_parameters: int, n_reactions: int, n_exclusive: int = 0):
+    """
+    Build a :py:class:`Combinations` subclass with a linear chain of
+    `n_reactions` reactions and `n_parameters` rate constants, plus
+    `n_hypotheses` extensions.
+
+    Every third hypothesis replaces a core reaction, the others add a
+    reaction. Each hypothesis has its own rate constant, which is pruned
+    from every topology that doesn't include it, as are rate constants
+    beyond `n_reactions`.
+
+    Args:
+        n_hypotheses: number of hypothesis extensions
+        n_parameters: number of rate constants in the core model
+        n_reactions: number of reactions in the core model
+        n_exclusive:
+            number of mutually exclusive pairs, between consecutive
+            hypotheses (0, 1), (2, 3), ...
+
+    Returns:
+        A tuple of the subclass and the `mutually_exclusive_reactions`
+        argument to instantiate it with
+    """
+    species = ['S{}'.format(i) for i in range(n_reactions + 1)]
+
+    def core__variables(self):
+        return '\n' + '\n'.join(['compartment Cell;'] + ['var {} in Cell;'.format(i) for i in species]) + '\n'
+
+    def core__reactions(self):
+        return '\n'.join('R{0}: {1} -> {2}; k{3}*{1};'.format(i, species[i], species[i + 1], i % n_parameters)
+                         for i in range(n_reactions)) + '\n'
+
+    def core__parameters(self):
+        lines = ['k{} = 0.1;'.format(i) for i in range(n_parameters)]
+        lines += ['kext{} = 0.1;'.format(i) for i in range(n_hypotheses)]
+        lines += ['{} = 10;'.format(i) for i in species]
+        lines += ['Cell = 1;']
+        return '\n'.join(lines) + '\n'
+
+    attrs = dict(core__variables=core__variables, core__reactions=core__reactions,
+                 core__parameters=core__parameters)
+    for i in range(n_hypotheses):
+        if i % 3 == 2:
+            j = i % n_reactions
+            def extension(self, i=i, j=j):
+                return HypothesisExtension(name='Ext{}'.format(i), reaction='{} -> {}'.format(species[j], species[j + 1]),
+                                           rate_law='kext{}*{}'.format(i, species[j]), mode='replace',
+                                           to_replace='R{}'.format(j))
+        else:
+            def extension(self, i=i):
+                return HypothesisExtension(name='Ext{}'.format(i), reaction='{} -> S0'.format(species[-1]),
+                                           rate_law='kext{}*{}'.format(i, species[-1]))
+        # zero padded so that the hypothesis index is i
+        attrs['extension_hypothesis__ext{:04d}'.format(i)] = extension
+
+    cls = type('Synthetic{}x{}x{}'.format(n_hypotheses, n_parameters, n_reactions), (Combinations,), attrs)
+    exclusive = [('Ext{}'.format(2 * i), 'Ext{}'.format(2 * i + 1)) for i in range(n_exclusive)]
+    return cls, exclusive
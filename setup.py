@@ -11,6 +11,7 @@ setup(
     version=version,
     packages=['antimony_combinations'],
     license='MIT',
+    python_requires='>=3.8',
     long_description=open('README.md').read(),
     author='Ciaran Welsh',
     author_email='ciaran.welsh@newcastle.ac.uk',
@@ -1,11 +1,34 @@
 import unittest
-
-from antimony_combinations.antimony_combinations import Combinations, HypothesisExtension
+import copy
+import doctest
+import subprocess
+import sys
+
+from antimony_combinations.antimony_combinations import Combinations, HypothesisExtension, TopologyIndex, \
+    TopologyView, AntimonyBuilder
+from antimony_combinations import parallel
+from antimony_combinations.archive import TopologyArchive
+from antimony_combinations.cache import ModelCache
+from antimony_combinations.constraints import Requires, Forbid, AtMost, ExactlyOne
+from antimony_combinations.instrumentation import Instrumentation, CSVSink
 import os
 import glob
+import pickle
+import random
+import time
+import numpy
+from itertools import combinations
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 from shutil import rmtree
 
 
+def _slow_topology(combinations, topology):
+    # module level so that it can be sent to worker processes
+    time.sleep(0.2)
+    return topology
+
+
 class TearDown(unittest.TestCase):
 
     def tearDown(self) -> None:
@@ -306,6 +329,17 @@ class CombinationsTestNoMutualExclusivitity(TearDown):
     def test_list_constructor(self):
         print(list(self.c))
 
+    def test_core_template_is_cached(self):
+        self.assertIs(self.c.core_template, self.c.core_template)
+
+    def test_core_template_reactions_are_read_only(self):
+        with self.assertRaises(TypeError):
+            self.c.core_template.reactions['TGFbR1'] = 'TGFbR1: Smad2 => pSmad2; k*Smad2'
+
+    def test_core_template_reaction_lookup(self):
+        expected = 'TGFbR2: pSmad2 => Smad2 ; _kSmad2Dephos*pSmad2;'
+        self.assertEqual(expected, self.c.core_template.reactions['TGFbR2'])
+
     def test_get_reactioin_names(self):
         expected = ['TGFbR1', 'TGFbR2', 'MAPKR1', 'MAPKR2', 'MAPKR3', 'PI3KR1', 'PI3KR2', 'PI3KR3', 'PI3KR4', 'PI3KR5']
         actual = self.c.get_reaction_names()
@@ -316,6 +350,108 @@ class CombinationsTestNoMutualExclusivitity(TearDown):
         actual = [i.topology for i in self.c[:10:2]]
         self.assertEqual(expected, actual)
 
+    def test_slice_returns_views(self):
+        for view in self.c[:5]:
+            self.assertIsInstance(view, TopologyView)
+            self.assertIs(self.c, view.parent)
+
+    def test_negative_index(self):
+        self.assertEqual(len(self.c) - 1, self.c[-1].topology)
+        self.assertEqual(self.c.view(len(self.c) - 1).to_antimony(), self.c[-1].to_antimony())
+        with self.assertRaises(IndexError):
+            self.c[-len(self.c) - 1]
+
+    def test_index_with_numpy_ids(self):
+        ids = self.c.topologies_containing('ErkActivatesS6K')
+        self.assertEqual(int(ids[0]), self.c[ids[0]].topology)
+        self.assertIsInstance(self.c.topology, int)
+        self.assertEqual(ids.tolist(), [i.topology for i in self.c[list(ids)]])
+        self.assertEqual(self.c[int(ids[1])].to_antimony(), self.c.view(ids[1]).to_antimony())
+
+    def test_view_forwards_to_parent(self):
+        for view in self.c.to_list()[:3]:
+            self.assertEqual(self.c.directory, view.directory)
+            self.assertEqual(self.c.topology_names, view.topology_names)
+            self.assertEqual(len(self.c), len(view.get_topologies()))
+            self.assertEqual(os.path.join(view.topology_dir, 'Topology{}'.format(view.topology)), view.cps_file)
+        with self.assertRaises(AttributeError):
+            self.c.view(0).not_an_attribute
+        with self.assertRaises(AttributeError):
+            self.c.view(0).__not_forwarded__
+
+    def test_view_binds_subclass_methods(self):
+        class Named(type(self.c)):
+            def model_name(self):
+                return 'Sub' + self.to_antimony().split('model ', 1)[1].split()[0]
+
+            @property
+            def model_topology(self):
+                return self.topology
+
+        c = Named(directory=self.c.directory)
+        views = c[3:6]
+        self.assertEqual(['Sub{}Topology{}'.format(c.__class__.__name__, i) for i in range(3, 6)],
+                         [i.model_name() for i in views])
+        self.assertEqual([3, 4, 5], [i.model_topology for i in views])
+        self.assertEqual(0, c.topology)
+
+    def test_views_do_not_change_parent_topology(self):
+        views = self.c.to_list()
+        views[7].to_antimony()
+        views[16].get_hypotheses()
+        self.assertEqual(0, self.c.topology)
+
+    def test_model_variant_reactions_method_is_not_shadowed(self):
+        reactions, names = self.c._model_variant_reactions()
+        self.assertEqual(self.c.topology_names, names)
+        self.assertEqual(list(self.c.model_variant_reactions), list(reactions))
+
+    def test_view_builds_same_model(self):
+        view = self.c.items()[16][1]
+        self.assertEqual(self.c[16].get_hypotheses(), view.get_hypotheses())
+        self.assertEqual(self.c[16].to_antimony(), view.to_antimony())
+
+    def test_views_have_no_instance_dict(self):
+        self.assertFalse(hasattr(self.c.to_list()[0], '__dict__'))
+
+    def test_nested_iteration(self):
+        pairs = [(i.topology, j.topology) for i in self.c for j in self.c]
+        self.assertEqual(31 * 31, len(pairs))
+
+    def test_view_is_bounds_checked(self):
+        self.assertEqual(30, self.c.view(-1).topology)
+        with self.assertRaises(IndexError):
+            self.c.view(31)
+
+    def test_build_from_threads(self):
+        expected = [self.c.view(i).to_antimony() for i in range(len(self.c))]
+        with ThreadPoolExecutor(4) as pool:
+            actual = list(pool.map(self.c.build, range(len(self.c))))
+        self.assertEqual(expected, actual)
+        self.assertEqual(0, self.c.topology)
+
+    def test_iter_topologies(self):
+        records = list(self.c.iter_topologies(start=10, stop=14))
+        self.assertEqual([10, 11, 12, 13], [i.topology for i in records])
+        self.assertEqual(self.c.view(12).to_antimony(), records[2].antimony)
+        self.assertEqual((), next(self.c.iter_topologies()).hypotheses)
+
+    def test_iter_topologies_shards_partition_the_space(self):
+        shards = [[i.topology for i in self.c.iter_topologies(start=3, shard=k, num_shards=4)]
+                  for k in range(4)]
+        self.assertEqual(list(range(3, 31)), sorted(sum(shards, [])))
+        self.assertTrue(all(i % 4 == 1 for i in shards[1]))
+
+    def test_iter_topologies_bad_arguments(self):
+        for kwargs in [dict(start=-1), dict(num_shards=0), dict(shard=4, num_shards=4)]:
+            with self.assertRaises(ValueError):
+                self.c.iter_topologies(**kwargs)
+
+    def test_iter_topologies_filter(self):
+        records = self.c.iter_topologies(filter=lambda topology, hypotheses: 'ErkActivatesS6K' in hypotheses)
+        for record in records:
+            self.assertIn('ErkActivatesS6K', self.c.view(record.topology).get_hypotheses())
+
     def test_subset_by_list(self):
         actual = [4, 9]
         expected = [i.topology for i in self.c[actual]]
@@ -583,11 +719,304 @@ class CombinationsTestWithMutualExclusivitity(TearDown):
         actual = len(self.c)
         self.assertEqual(expected, actual)
 
+    def test_exclusive_group(self):
+        self.c.mutually_exclusive_reactions = [('CrossTalkR1', 'CrossTalkR2', 'CrossTalkR4')]
+        self.assertEqual(16, len(self.c))
+
+    def test_combinations_are_cached(self):
+        first = self.c._get_combinations()
+        self.assertIs(first, self.c._get_combinations())
+
+    def test_cache_invalidated_by_new_mutually_exclusive_reactions(self):
+        self.assertEqual(24, len(self.c))
+        self.c.mutually_exclusive_reactions = []
+        self.assertEqual(31, len(self.c))
+
     def test_getitem(self):
         mod4 = self.c[4]
         self.assertEqual(mod4.topology, 4)
 
 
+class TopologyIndexTests(unittest.TestCase):
+
+    def brute_force(self, n, exclusive):
+        return [c for size in range(n) for c in combinations(range(n), size)
+                if not any(set(pair).issubset(c) for pair in exclusive)]
+
+    def test_docstring_examples(self):
+        finder = doctest.DocTestFinder(recurse=False)
+        runner = doctest.DocTestRunner(verbose=False)
+        for test in finder.find(TopologyIndex, globs={'TopologyIndex': TopologyIndex}):
+            runner.run(test)
+        self.assertEqual(0, runner.summarize(verbose=False).failed)
+
+    def test_order_matches_itertools(self):
+        index = TopologyIndex(5)
+        self.assertEqual(self.brute_force(5, []), list(index))
+
+    def test_multiple_pairs_are_not_duplicated(self):
+        exclusive = [(0, 1), (1, 3), (2, 4)]
+        index = TopologyIndex(6, exclusive=exclusive)
+        expected = self.brute_force(6, exclusive)
+        self.assertEqual(expected, list(index))
+        self.assertEqual(len(expected), len(index))
+
+    def test_rank_unrank_round_trip(self):
+        exclusive = [(0, 2), (3, 4)]
+        index = TopologyIndex(6, exclusive=exclusive)
+        for i, subset in enumerate(self.brute_force(6, exclusive)):
+            self.assertEqual(subset, index.unrank(i))
+            self.assertEqual(i, index.rank(subset))
+
+    def test_rank_of_excluded_subset(self):
+        index = TopologyIndex(4, exclusive=[(1, 2)])
+        with self.assertRaises(ValueError):
+            index.rank((0, 1, 2))
+
+    def test_unrank_out_of_range(self):
+        index = TopologyIndex(4)
+        with self.assertRaises(IndexError):
+            index.unrank(len(index))
+
+    def test_exclusive_group_allows_at_most_one(self):
+        index = TopologyIndex(5, exclusive=[(0, 1, 2)])
+        expected = [c for size in range(5) for c in combinations(range(5), size)
+                    if len({0, 1, 2}.intersection(c)) <= 1]
+        self.assertEqual(expected, list(index))
+
+    def test_masks_are_in_topology_order(self):
+        index = TopologyIndex(7, exclusive=[(0, 3), (2, 4, 6)])
+        expected = [sum(1 << i for i in subset) for subset in index]
+        self.assertEqual(expected, index.masks().tolist())
+
+    def test_filter_masks(self):
+        import numpy
+        index = TopologyIndex(4, exclusive=[(1, 2)])
+        masks = numpy.arange(16, dtype=numpy.uint64)
+        expected = [index.is_valid(int(i)) for i in masks]
+        self.assertEqual(expected, index.filter_masks(masks).tolist())
+        self.assertFalse(index.is_valid(0b0110))
+
+    def test_requires_and_cardinality(self):
+        index = TopologyIndex(6, forbidden=[(1, 2, 3)], requires=[(0, (4, 5))], cardinality=[((1, 2, 3, 4), 1, 2)])
+        expected = [c for r in range(6) for c in combinations(range(6), r)
+                    if not {1, 2, 3}.issubset(c) and (0 not in c or {4, 5} & set(c))
+                    and 1 <= len({1, 2, 3, 4} & set(c)) <= 2]
+        self.assertEqual(expected, list(index))
+        self.assertEqual(expected.index((0, 2, 4)), index.rank((0, 2, 4)))
+
+    def test_at_most_every_hypothesis_bounds_size(self):
+        index = TopologyIndex(30, cardinality=[(tuple(range(30)), 0, 2)])
+        self.assertEqual(1 + 30 + 435, len(index))
+        self.assertEqual(2, index.max_size)
+
+    def test_bounded_size(self):
+        index = TopologyIndex(50, min_size=1, max_size=3)
+        self.assertEqual(50 + 1225 + 19600, len(index))
+        self.assertEqual((0,), index.unrank(0))
+        masks = index.masks()
+        self.assertEqual(len(index), len(masks))
+        self.assertEqual((1 << 2) | (1 << 49), int(masks[index.rank((2, 49))]))
+
+    def test_large_space_without_enumeration(self):
+        index = TopologyIndex(40, exclusive=[(0, 1), (5, 9), (12, 30)])
+        subset = index.unrank(123456789)
+        self.assertEqual(123456789, index.rank(subset))
+
+
+class BuildAntimonyTests(TearDown):
+    class PrefixModel(Combinations):
+
+        def core__variables(self):
+            return """
+                compartment Cell;
+                var A in Cell;
+                var B in Cell;
+                """
+
+        def core__reactions(self):
+            return """
+                R1: A -> B; k10*A; // k2 is not used
+                """
+
+        def core__parameters(self):
+            return """
+                k1 = 0.1;
+                k10 = 0.1;
+                k1b = 0.1;
+                k2 = 0.1;
+                kd = 0.5;
+                kdeg := kd * 2;
+                A = 10;
+                B = 0;
+                Cell = 1;
+                """
+
+        def core__events(self):
+            return """
+                E1: at (time>1 and k1b > 0): A=10;
+                """
+
+        def extension_hypothesis__backward(self):
+            return HypothesisExtension(
+                name='Backward',
+                reaction='B -> A',
+                rate_law='k1*B',
+                mode='additive',
+            )
+
+        def extension_hypothesis__degradation(self):
+            return HypothesisExtension(
+                name='Degradation',
+                reaction='B -> ',
+                rate_law='k10*B',
+                mode='additive',
+            )
+
+        def extension_hypothesis__turnover(self):
+            return HypothesisExtension(
+                name='Turnover',
+                reaction='A -> ',
+                rate_law='kdeg*A',
+                mode='additive',
+            )
+
+    def setUp(self) -> None:
+        self.c = self.PrefixModel(directory=os.path.dirname(__file__))
+
+    def test_pickle_after_build(self):
+        expected = self.c.to_antimony()
+        template = pickle.loads(pickle.dumps(self.c.core_template))
+        self.assertEqual(self.c.core_template, template)
+        self.assertIsInstance(template.reactions, MappingProxyType)
+        for c in [pickle.loads(pickle.dumps(self.c)), copy.deepcopy(self.c)]:
+            self.assertEqual(expected, c.to_antimony())
+
+    def test_prefix_of_used_parameter_is_pruned(self):
+        ant = self.c[0].to_antimony()
+        self.assertIn('k10 = 0.1;', ant)
+        self.assertNotIn('k1 = 0.1;', ant)
+
+    def test_used_parameter_is_kept(self):
+        ant = self.c[1].to_antimony()
+        self.assertIn('k1 = 0.1;', ant)
+
+    def test_pruning_does_not_touch_other_sections(self):
+        ant = self.c[0].to_antimony()
+        self.assertIn('E1: at (time>1 and k1b > 0): A=10;', ant)
+
+    def test_parameter_used_by_event_is_kept(self):
+        ant = self.c[0].to_antimony()
+        self.assertIn('k1b = 0.1;', ant)
+
+    def test_assignment_rule_dependencies_are_kept(self):
+        self.assertEqual(['turnover'], self.c[3].get_hypotheses())
+        ant = self.c[3].to_antimony()
+        self.assertIn('kdeg := kd * 2;', ant)
+        self.assertIn('kd = 0.5;', ant)
+        ant = self.c[0].to_antimony()
+        self.assertNotIn('kdeg := kd * 2;', ant)
+        self.assertNotIn('kd = 0.5;', ant)
+
+    def test_identifier_in_comment_does_not_keep_parameter(self):
+        ant = self.c[0].to_antimony()
+        self.assertNotIn('k2 = 0.1;', ant)
+
+
+class DeduplicationTests(TearDown):
+    class DuplicateModel(Combinations):
+
+        def core__variables(self):
+            return """
+                compartment Cell;
+                var A in Cell;
+                var B in Cell;
+                """
+
+        def core__reactions(self):
+            return """
+                R1: A -> B; k1*A;
+                """
+
+        def core__parameters(self):
+            return """
+                k1 = 0.1;
+                k2 = 0.1;
+                A = 10;
+                B = 0;
+                Cell = 1;
+                """
+
+        def extension_hypothesis__backward(self):
+            return HypothesisExtension(
+                name='Backward',
+                reaction='B -> A',
+                rate_law='k2*B',
+                mode='additive',
+            )
+
+        def extension_hypothesis__degradation(self):
+            return HypothesisExtension(
+                name='Degradation',
+                reaction='B -> ',
+                rate_law='k2*B',
+                mode='additive',
+            )
+
+        def extension_hypothesis__restated(self):
+            return HypothesisExtension(
+                name='Restated',
+                reaction='A  ->  B',
+                rate_law='k1*A',
+                mode='replace',
+                to_replace='R1',
+            )
+
+    def setUp(self) -> None:
+        self.c = self.DuplicateModel(directory=os.path.dirname(__file__))
+
+    def test_network_key_ignores_labels_and_whitespace(self):
+        self.assertEqual(['restated'], self.c.view(3).get_hypotheses())
+        self.assertEqual(self.c.network_key(0), self.c.network_key(3))
+        self.assertNotEqual(self.c.network_key(0), self.c.network_key(1))
+
+    def test_equivalence_classes(self):
+        classes = list(self.c.equivalence_classes().values())
+        self.assertEqual([[0, 3], [1, 5], [2, 6], [4]], classes)
+
+    def test_simulate_all_deduplicate(self):
+        selections = ['time', '[A]', '[B]']
+        expected = self.c.simulate_all(0, 10, 11, selections=selections, workers=1, stack=True)
+        actual = self.c.simulate_all(0, 10, 11, selections=selections, workers=1, stack=True,
+                                     deduplicate=True)
+        self.assertEqual(expected.topologies.tolist(), actual.topologies.tolist())
+        self.assertTrue(numpy.allclose(expected.data, actual.data))
+
+
+class ImportTimeTests(unittest.TestCase):
+    heavy_modules = ['tellurium', 'roadrunner', 'pycotools3', 'matplotlib', 'seaborn', 'yaml', 'pandas']
+
+    def import_in_subprocess(self):
+        code = ('import sys, time\n'
+                'start = time.perf_counter()\n'
+                'import antimony_combinations\n'
+                'print(time.perf_counter() - start)\n'
+                'print(",".join(m for m in {} if m in sys.modules))'.format(self.heavy_modules))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=root, universal_newlines=True)
+        seconds, loaded = out.split('\n')[:2]
+        return float(seconds), loaded
+
+    def test_heavy_backends_not_imported(self):
+        seconds, loaded = self.import_in_subprocess()
+        self.assertEqual('', loaded)
+
+    def test_import_time(self):
+        seconds = min(self.import_in_subprocess()[0] for _ in range(3))
+        print('import antimony_combinations: {:.3f}s'.format(seconds))
+        self.assertLess(seconds, 1.0)
+
+
 class AnotherExampleTests(TearDown):
     class MyCombModel(Combinations):
 
@@ -697,6 +1126,313 @@ class AnotherExampleTests(TearDown):
             ('Feedback1', 'Feedback2')
         ], directory=directory)
 
+    def test_export_all_antimony_in_parallel(self):
+        summary = self.c.export_all(format='antimony', workers=2)
+        self.assertEqual(len(self.c), len(summary.files))
+        with open(os.path.join(os.path.dirname(__file__), 'Topology7', 'topology7.ant')) as f:
+            self.assertEqual(self.c[7].to_antimony(), f.read())
+
+    def test_pickle_drops_caches(self):
+        self.c.topology_masks()
+        self.c.to_antimony()
+        c = pickle.loads(pickle.dumps(self.c))
+        self.assertIsNone(c._masks)
+        self.assertIsNone(c._template)
+        self.assertEqual(self.c.topology_masks().tolist(), c.topology_masks().tolist())
+
+    def test_export_all_sbml(self):
+        summary = self.c.export_all(format='sbml', workers=1, topologies=[0, 3])
+        self.assertEqual(2, len(summary.files))
+        for fname in summary.files:
+            self.assertTrue(os.path.isfile(fname))
+
+    def test_simulate_all_streams_arrays(self):
+        results = dict(self.c.simulate_all(0, 10, 11, workers=2, topologies=[0, 1, 2]))
+        self.assertEqual([0, 1, 2], sorted(results))
+        self.assertEqual((11, 7), results[1].shape)
+
+    def test_simulate_all_reports_failures(self):
+        class Broken(self.MyCombModel):
+            def extension_hypothesis__broken(self):
+                return HypothesisExtension(name='Broken', reaction='B -> A', rate_law='k2 * * B')
+
+        c = Broken(directory=self.c.directory)
+        broken = c.find(['broken'])
+        results = dict(c.simulate_all(0, 10, 11, workers=1, topologies=[0, broken]))
+        self.assertEqual((11, 7), results[0].shape)
+        self.assertIsNone(results[broken])
+
+    def test_closing_stream_does_not_wait_for_batch(self):
+        results = parallel.map_topologies(self.c, _slow_topology, range(40), workers=2, chunksize=1)
+        next(results)
+        start = time.perf_counter()
+        results.close()
+        # the whole batch takes about 4 seconds on 2 workers
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_simulate_all_stacked(self):
+        results = self.c.simulate_all(0, 10, 11, selections=['time', '[pA]'], workers=1,
+                                      topologies=[3, 0], stack=True)
+        self.assertEqual([0, 3], list(results.topologies))
+        self.assertEqual((2, 11, 2), results.data.shape)
+        self.assertEqual((2, 11), results['[pA]'].shape)
+
+    def test_model_cache_reuses_compiled_model(self):
+        self.c.model_cache = ModelCache(maxsize=2)
+        first = self.c[1].to_roadrunner()
+        first.simulate(0, 10, 11)
+        second = self.c[1].to_roadrunner()
+        self.assertIs(first, second)
+        self.assertEqual(10, second['init([A])'])
+        info = self.c.model_cache.cache_info()
+        self.assertEqual((1, 1), (info.hits, info.misses))
+
+    def test_model_cache_evicts_least_recently_used(self):
+        self.c.model_cache = ModelCache(maxsize=2)
+        for i in [0, 1, 2]:
+            self.c[i].to_roadrunner()
+        info = self.c.model_cache.cache_info()
+        self.assertEqual((1, 2), (info.evictions, info.currsize))
+
+    def test_model_cache_on_disk(self):
+        cache_dir = os.path.join(os.path.dirname(__file__), 'Topology_cache')
+        self.c.model_cache = ModelCache(directory=cache_dir, maxsize=0)
+        sbml = self.c[2].to_sbml()
+        self.c.model_cache = ModelCache(directory=cache_dir, maxsize=0)
+        self.assertEqual(sbml, self.c[2].to_sbml())
+        self.assertEqual(1, self.c.model_cache.cache_info().disk_hits)
+
+    def test_get_topologies(self):
+        df = self.c.get_topologies()
+        self.assertEqual('ModelID', df.index.name)
+        self.assertEqual('Null', df.loc[0, 'Topology'])
+        self.assertEqual('additive1__feedback2', df.loc[8, 'Topology'])
+        self.assertEqual(len(self.c), len(df))
+
+    def test_topology_matrix(self):
+        matrix = self.c.topology_matrix()
+        self.assertEqual((24, 5), matrix.shape)
+        for i in [0, 8, 23]:
+            names = [self.c.topology_names[j] for j in matrix[i].nonzero()[0]]
+            self.assertEqual(self.c.view(i).get_hypotheses(), names or ['Null'])
+
+    def test_query(self):
+        actual = self.c.query(include=['Feedback1'], exclude=['replace_reaction']).tolist()
+        expected = [i for i in range(len(self.c))
+                    if 'feedback1' in self.c.view(i).get_hypotheses()
+                    and 'replace_reaction' not in self.c.view(i).get_hypotheses()]
+        self.assertEqual(expected, actual)
+
+    def test_query_unknown_hypothesis(self):
+        with self.assertRaises(ValueError):
+            self.c.query(include=['NotAHypothesis'])
+
+    def test_iter_antimony_matches_build(self):
+        expected = [self.c.build(i) for i in range(len(self.c))]
+        self.assertEqual(expected, [antimony for topology, antimony in self.c.iter_antimony()])
+
+    def test_antimony_builder_in_any_order(self):
+        order = list(range(len(self.c)))
+        random.Random(1).shuffle(order)
+        builder = AntimonyBuilder(self.c)
+        for i in order:
+            self.assertEqual(self.c.build(i), builder.build(i))
+
+    def test_export_archive(self):
+        path = os.path.join(os.path.dirname(__file__), 'Topology_archive', 'models.zip')
+        summary = self.c.export_archive(path, workers=1)
+        self.assertEqual(len(self.c), len(summary.files))
+        self.assertFalse(os.path.isdir(os.path.join(os.path.dirname(__file__), 'Topology8')))
+        with TopologyArchive(path) as archive:
+            self.assertEqual(list(range(len(self.c))), archive.topologies)
+            self.assertEqual(self.c.build(8), archive[8])
+            self.assertEqual(('additive1', 'feedback2'), archive.hypotheses(8))
+
+    def test_export_archive_numpy_ids(self):
+        path = os.path.join(os.path.dirname(__file__), 'Topology_archive', 'models.zip')
+        ids = self.c.query(include=['feedback1'])
+        self.c.export_archive(path, workers=1, topologies=ids)
+        with TopologyArchive(path) as archive:
+            self.assertEqual(ids.tolist(), archive.topologies)
+
+    def test_archive_extract(self):
+        path = os.path.join(os.path.dirname(__file__), 'Topology_archive', 'models.zip')
+        self.c.export_archive(path, workers=1, topologies=[3, 8])
+        with TopologyArchive(path) as archive:
+            self.assertNotIn(4, archive)
+            fname = archive.extract(8, os.path.dirname(__file__))
+        self.assertEqual(self.c._topology_file(8, 'ant'), fname)
+        with open(fname) as f:
+            self.assertEqual(self.c.build(8), f.read())
+
+    def test_path_properties_do_not_create_directories(self):
+        view = self.c.view(5)
+        for i in [self.c.topology_dir, self.c.time_course_graphs, self.c.copasi_file, self.c.cps_file,
+                  view.topology_dir, view.antimony_file]:
+            self.assertFalse(os.path.exists(i))
+        self.assertEqual([], glob.glob(os.path.join(os.path.dirname(__file__), 'Topology*')))
+
+    def test_export_creates_topology_directories(self):
+        self.c.export_all(workers=1, topologies=[5])
+        self.assertTrue(os.path.isfile(self.c.view(5).antimony_file))
+
+    def test_to_copasi_all_reports_failures(self):
+        class FailingCopasi(self.MyCombModel):
+            def _to_copasi(self, antimony, copasi_file):
+                if 'Feedback2' in antimony:
+                    raise ValueError('conversion failed')
+                with open(copasi_file, 'w') as f:
+                    f.write(antimony)
+
+        c = FailingCopasi(mutually_exclusive_reactions=self.c.mutually_exclusive_reactions,
+                          directory=self.c.directory)
+        results = c.to_copasi_all(workers=1)
+        self.assertEqual(list(range(len(c))), [i.topology for i in results])
+        failed = [i.topology for i in results if i.error is not None]
+        self.assertEqual(c.topologies_containing('feedback2').tolist(), failed)
+        for i in results:
+            if i.error is None:
+                self.assertTrue(os.path.isfile(i.copasi_file))
+
+    def test_instrumentation_times_stages(self):
+        calls = []
+        self.c.instrumentation = Instrumentation(sink=lambda *args: calls.append(args))
+        self.c.view(3).to_antimony()
+        summary = self.c.instrumentation.summary()
+        self.assertEqual(1, summary['build_antimony'].calls)
+        self.assertEqual(1, summary['build_reactions'].calls)
+        self.assertEqual(['index', 'build_reactions', 'build_antimony'], [i[0] for i in calls])
+
+    def test_instrumentation_times_enumeration(self):
+        self.c.instrumentation = Instrumentation()
+        len(self.c)
+        self.c.get_topologies()
+        self.c.find(['feedback1'])
+        summary = self.c.instrumentation.summary()
+        self.assertEqual(1, summary['index'].calls)
+        self.assertEqual(1, summary['enumerate'].calls)
+
+    def test_instrumentation_times_streamed_simulations(self):
+        self.c.instrumentation = Instrumentation()
+        with self.assertLogs('antimony_combinations.antimony_combinations', level='INFO') as logs:
+            results = list(self.c.simulate_all(0, 10, 11, workers=1, topologies=[0, 1]))
+        self.assertEqual(2, len(results))
+        self.assertEqual(2, self.c.instrumentation.summary()['simulate'].calls)
+        self.assertIn('simulate', logs.output[-1])
+
+    def test_instrumentation_removed_when_disabled(self):
+        self.c.instrumentation = Instrumentation()
+        self.assertIn('_build_antimony', self.c.__dict__)
+        self.c.instrumentation = None
+        self.assertNotIn('_build_antimony', self.c.__dict__)
+
+    def test_instrumentation_merges_worker_timings(self):
+        fname = os.path.join(os.path.dirname(__file__), 'Topology_timings', 'timings.csv')
+        os.makedirs(os.path.dirname(fname))
+        self.c.instrumentation = Instrumentation(sink=CSVSink(fname))
+        self.c.export_all(workers=2)
+        self.assertEqual(len(self.c), self.c.instrumentation.summary()['build_antimony'].calls)
+        with open(fname) as f:
+            self.assertEqual(len(self.c), sum(1 for i in f if ',build_antimony,' in i))
+
+    def test_constraints(self):
+        c = self.MyCombModel(constraints=[
+            Requires('Feedback2', 'Feedback1'),
+            AtMost(3),
+            ExactlyOne(['AdditiveReaction1', 'additive2']),
+            Forbid(['Feedback1', 'Feedback2', 'replace_reaction']),
+        ], directory=self.c.directory)
+        names = list(c.topology_names.values())
+        expected = []
+        for size in range(len(names)):
+            for subset in combinations(names, size):
+                if 'feedback2' in subset and 'feedback1' not in subset:
+                    continue
+                if size > 3 or ('additive1' in subset) == ('additive2' in subset):
+                    continue
+                if {'feedback1', 'feedback2', 'replace_reaction'}.issubset(subset):
+                    continue
+                expected.append(list(subset))
+        self.assertEqual(expected, [view.get_hypotheses() for view in c])
+        self.assertEqual(len(expected), len(c))
+
+    def test_max_hypotheses(self):
+        c = self.MyCombModel(mutually_exclusive_reactions=[('Feedback1', 'Feedback2')],
+                             max_hypotheses=2, directory=self.c.directory)
+        self.assertEqual(1 + 5 + 10 - 1, len(c))
+        self.assertEqual(len(c), len(list(c)))
+        self.assertTrue(all(len(view.get_hypotheses()) <= 2 for view in c))
+
+    def test_max_hypotheses_includes_full_set(self):
+        c = self.MyCombModel(max_hypotheses=5, directory=self.c.directory)
+        self.assertEqual(32, len(c))
+        self.assertEqual(sorted(c.topology_names.values()), c.view(-1).get_hypotheses())
+
+    def test_min_hypotheses(self):
+        self.c.min_hypotheses = 2
+        self.assertEqual(24 - 1 - 5, len(self.c))
+        self.assertEqual(['additive1', 'additive2'], self.c.view(0).get_hypotheses())
+        self.assertEqual(0, self.c.find(['additive1', 'additive2']))
+
+    def test_hypotheses_bounds_out_of_range(self):
+        for kwargs in [dict(max_hypotheses=6), dict(max_hypotheses=-1), dict(min_hypotheses=-1),
+                       dict(min_hypotheses=6), dict(min_hypotheses=5), dict(min_hypotheses=3, max_hypotheses=2)]:
+            with self.assertRaises(ValueError):
+                self.MyCombModel(directory=self.c.directory, **kwargs)
+        with self.assertRaises(ValueError):
+            self.c.max_hypotheses = 6
+        with self.assertRaises(ValueError):
+            self.c.min_hypotheses = -1
+        self.assertEqual(0, self.c.min_hypotheses)
+        self.assertIsNone(self.c.max_hypotheses)
+        # only the model with every hypothesis
+        self.assertEqual(1, len(self.MyCombModel(directory=self.c.directory, min_hypotheses=5, max_hypotheses=5)))
+
+    def test_constraint_with_unknown_hypothesis(self):
+        self.c.constraints = [AtMost(1, ['Feedback1', 'NotAHypothesis'])]
+        with self.assertRaises(ValueError):
+            len(self.c)
+
+    def test_find_is_inverse_of_get_hypotheses(self):
+        for i in range(len(self.c)):
+            self.assertEqual(i, self.c.find(self.c.view(i).get_hypotheses()))
+
+    def test_find_excluded_combination(self):
+        with self.assertRaises(ValueError):
+            self.c.find(['Feedback1', 'Feedback2'])
+
+    def test_sample_uniform(self):
+        sample = self.c.sample(5, seed=3, stratify_by_size=False)
+        topologies = [i.topology for i in sample]
+        self.assertEqual(sorted(set(topologies)), topologies)
+        self.assertTrue(all(0 <= i < len(self.c) for i in topologies))
+        self.assertEqual(topologies, [i.topology for i in self.c.sample(5, seed=3, stratify_by_size=False)])
+
+    def test_sample_stratified_covers_every_size(self):
+        sizes = {len(self.c.topology_index.unrank(i.topology))
+                 for i in self.c.sample(len(self.c.topology_index._size_counts), seed=0)}
+        self.assertEqual(set(range(len(self.c.topology_index._size_counts))), sizes)
+
+    def test_sample_everything(self):
+        self.assertEqual(list(range(len(self.c))), [i.topology for i in self.c.sample(len(self.c), seed=0)])
+        with self.assertRaises(ValueError):
+            self.c.sample(len(self.c) + 1)
+
+    def test_sample_without_enumerating(self):
+        # 40 more hypotheses on top of MyCombModel, far too many topologies to enumerate
+        extensions = {'extension_hypothesis__ext{:02d}'.format(i): lambda self, i=i: HypothesisExtension(
+            name='Ext{}'.format(i), reaction='A -> pA', rate_law='k{} * A'.format(i)) for i in range(40)}
+        c = type('Large', (self.MyCombModel,), extensions)(directory=self.c.directory)
+        self.assertGreater(len(c), 2 ** 40)
+        sample = c.sample(1000, seed=0)
+        self.assertEqual(1000, len(set(i.topology for i in sample)))
+        self.assertEqual(sample[-1].topology, c.find(sample[-1].get_hypotheses()))
+
+    def test_topologies_containing(self):
+        actual = self.c.topologies_containing('feedback1').tolist()
+        expected = [i for i in range(len(self.c)) if 'feedback1' in self.c.view(i).get_hypotheses()]
+        self.assertEqual(expected, actual)
+
     def test__output_used_in_docs(self):
         """
         Keep for now. You may want to update the docs.